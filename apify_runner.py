@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from lazy import resolve
+
+# Apify 的執行結束狀態
+TERMINAL_STATUSES = {'SUCCEEDED', 'FAILED', 'ABORTED', 'TIMED-OUT'}
+# 單次長輪詢最多等待的秒數 (Apify API 上限為 60 秒)
+MAX_WAIT_SECS = 60
+
+
+class ApifyRunner:
+    """非同步執行 Apify Actor：啟動後以有上限的長輪詢等待，只取回需要的資料筆數，逾時即中止執行
+
+    actor_options 依 Actor id 設定 memory_mbytes、timeout_secs 與 build，例如
+    {"apify/website-content-crawler": {"memory_mbytes": 1024, "timeout_secs": 120}}
+    """
+
+    def __init__(self, client, timeout=180, poll_interval=5, actor_options=None):
+        self.client = client
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.actor_options = actor_options or {}
+        self.runs = 0
+        self.early_stops = 0
+        self.timeouts = 0
+        self.failed = 0
+
+    def timeout_for(self, actor_id):
+        return self.actor_options.get(actor_id, {}).get('timeout_secs', self.timeout)
+
+    async def _items(self, dataset_id, max_items):
+        page = await self.client.dataset(dataset_id).list_items(limit=max_items, clean=True)
+        return page.items
+
+    async def _abort(self, run_id):
+        try:
+            await self.client.run(run_id).abort()
+        except Exception as e:
+            print(f"Error aborting Apify run {run_id}: {e}")
+
+    async def run(self, actor_id, run_input, max_items=None):
+        """執行 Actor 並回傳資料集前 max_items 筆 (None 表示全部)
+
+        輪詢期間資料筆數一到就中止執行，不等 Actor 自行結束；超過 timeout_secs 時中止執行，
+        有部分結果就回傳部分結果，否則拋出 TimeoutError。
+        """
+        options = self.actor_options.get(actor_id, {})
+        timeout = options.get('timeout_secs', self.timeout)
+        deadline = time.monotonic() + timeout
+        await resolve(self.client)
+        # 平台端也設定相同的上限，即使本程序中斷也不會繼續計費
+        run = await self.client.actor(actor_id).start(
+            run_input=run_input,
+            build=options.get('build'),
+            memory_mbytes=options.get('memory_mbytes'),
+            timeout_secs=int(timeout),
+            wait_for_finish=min(MAX_WAIT_SECS, int(self.poll_interval))
+        )
+        self.runs += 1
+        run_id, dataset_id = run['id'], run['defaultDatasetId']
+        try:
+            while run['status'] not in TERMINAL_STATUSES:
+                if max_items:
+                    items = await self._items(dataset_id, max_items)
+                    if len(items) >= max_items:
+                        # 需要的結果已寫入資料集，剩下的工作不必等
+                        self.early_stops += 1
+                        await self._abort(run_id)
+                        return items
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    await self._abort(run_id)
+                    items = await self._items(dataset_id, max_items)
+                    if items:
+                        print(f"Apify run {run_id} timed out, using {len(items)} partial items")
+                        return items
+                    raise TimeoutError(f"Apify run {run_id} of {actor_id} timed out after {timeout}s")
+                wait = max(1, int(min(MAX_WAIT_SECS, self.poll_interval, remaining)))
+                run = await self.client.run(run_id).wait_for_finish(wait_secs=wait) or run
+        except asyncio.CancelledError:
+            # 外層逾時或取消時不留下仍在執行的 Actor
+            await asyncio.shield(self._abort(run_id))
+            raise
+        if run['status'] != 'SUCCEEDED':
+            self.failed += 1
+            print(f"Apify run {run_id} of {actor_id} finished with status {run['status']}")
+        return await self._items(dataset_id, max_items)
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "early_stops": self.early_stops,
+            "timeouts": self.timeouts,
+            "failed": self.failed,
+        }
@@ -1,11 +1,19 @@
 import os
 import sys
+import time
 import certifi
 
+# 啟動時必要模組 (FastAPI、LINE SDK 等) 的匯入耗時；各整合套件改為第一次使用時才匯入
+_import_started = time.perf_counter()
+
 # Fix SSL certificate verification error on macOS
 os.environ['SSL_CERT_FILE'] = certifi.where()
 
+import asyncio
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 
 from linebot.v3 import (
@@ -16,42 +24,97 @@ from linebot.v3.exceptions import (
 )
 from linebot.v3.messaging import (
     Configuration,
-    ApiClient,
-    MessagingApi,
-    MessagingApiBlob,
     ReplyMessageRequest,
+    PushMessageRequest,
     TextMessage
 )
+from linebot.v3.messaging.exceptions import ApiException
 from linebot.v3.webhooks import (
+    Event,
     MessageEvent,
     TextMessageContent,
     AudioMessageContent,
     ImageMessageContent
 )
-from openai import OpenAI
-from notion_client import Client
 from datetime import datetime
-import tempfile
-import io
+import json
 import base64
-import pytz
-import re
-import trafilatura
-from apify_client import ApifyClient
-
-# 設定時區為台灣
-TW_TIMEZONE = pytz.timezone('Asia/Taipei')
-# Google Drive API 相關匯入
-from google.auth.transport.requests import Request as GoogleRequest
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+import uuid
+import httpx
+
+from drive_client import DriveClientManager
+from job_queue import JobQueue
+from line_client import LineClient
+from pipeline import StageGraph
+from metrics import registry, span, current_note_type, enable_opentelemetry, stage_duration
+from dedup import EventDeduplicator
+from notion_writer import NotionWriter, TokenBucket
+from audio import AudioTranscriber
+from fetch_strategy import FetchStrategyEngine
+from summary_cache import SummaryCache
+from url_cache import ExtractionCache, canonicalize_url, needs_redirect_resolution, resolve_redirects
+from batcher import MicroBatcher
+from summarizer import MapReduceSummarizer
+from images import prepare_vision_image, sniff_image_format
+from job_store import JobStore, current_job_id
+from coordination import SharedTokenBucket, create_coordinator
+from resilience import CircuitOpenError, Upstream, is_transient
+from apify_runner import ApifyRunner
+from note_index import HashingEmbedder, NoteIndex, OpenAIEmbedder
+from url_router import Extractor, UrlRouter, find_urls
+from media import MediaBuffer
+from notion_sync import NotionSync
+from lazy import LazyClient, format_timings, import_timings, load, record_import, resolve
+
+record_import('app (startup imports)', time.perf_counter() - _import_started)
+
+def taiwan_now():
+    """目前的台灣時間 (pytz 於第一次使用時載入)"""
+    return datetime.now(load('pytz').timezone('Asia/Taipei'))
 
 # 載入環境變數
-load_dotenv(override=True)
+# DOTENV_PATH 可指定其他設定檔 (例如效能測試使用的本地替身設定)
+load_dotenv(os.getenv('DOTENV_PATH') or None, override=True)
+
+@asynccontextmanager
+async def lifespan(app):
+    # 啟動背景工作佇列，/callback 只負責驗證與排入佇列
+    await job_queue.start()
+    await line_client.start()
+    # 補回上次關閉或當機時尚未完成的工作 (已完成的階段不會重跑)
+    resume_task = asyncio.create_task(resume_unfinished_jobs(time.time()))
+    print(f"Startup imports: {format_timings()}")
+    # 開始接收 webhook 後才在背景預先載入指定的整合
+    warmup_task = asyncio.create_task(warm_up(warmup_targets)) if warmup_targets else None
+    outbox_task = None
+    if notion_writer:
+        # 定期重送先前寫入 Notion 失敗的頁面
+        outbox_task = asyncio.create_task(notion_writer.run_outbox_retry_loop(notion_outbox_retry_interval))
+    # 定期將 Notion 筆記資料庫增量同步到本地 Parquet
+    sync_task = asyncio.create_task(notion_sync.run_forever(notion_sync_interval)) if notion_sync else None
+    # 網域擷取策略統計定期寫回檔案
+    fetch_stats_task = asyncio.create_task(fetch_engine.run_flush_loop(fetch_stats_flush_interval))
+    yield
+    resume_task.cancel()
+    if warmup_task:
+        warmup_task.cancel()
+    if outbox_task:
+        outbox_task.cancel()
+    if sync_task:
+        sync_task.cancel()
+    fetch_stats_task.cancel()
+    await asyncio.to_thread(fetch_engine.flush)
+    await job_queue.stop()
+    # 關閉非同步用戶端的連線
+    await line_client.close()
+    await http_client.aclose()
+    # 只關閉實際建立過的用戶端
+    if client and client.loaded:
+        await client.close()
+    if notion and notion.loaded:
+        await notion.aclose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 從環境變數獲取憑證
 channel_secret = os.getenv('LINE_CHANNEL_SECRET')
@@ -63,6 +126,22 @@ google_drive_folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID', '1yeIYLXlEhDACEqARM
 allowed_line_id = os.getenv('ALLOWED_LINE_ID')
 apify_api_key = os.getenv('APIFY_API_KEY')
 threads_actor_id = os.getenv('THREADS_ACTOR_ID', 'sinam7/threads-post-scraper')
+job_queue_workers = int(os.getenv('JOB_QUEUE_WORKERS', '4'))
+job_queue_maxsize = int(os.getenv('JOB_QUEUE_MAXSIZE', '100'))
+# reply token 有效時間有限，超過此秒數改用 push message 回傳結果
+reply_token_ttl = float(os.getenv('REPLY_TOKEN_TTL_SECONDS', '50'))
+summary_model = os.getenv('OPENAI_SUMMARY_MODEL', 'gpt-4o-mini')
+# Vision 圖片解析度：auto (小圖 low、其餘 high)、low 或 high
+vision_image_detail = os.getenv('VISION_IMAGE_DETAIL', 'auto')
+# 本地資料 (快取、狀態) 存放目錄
+data_dir = os.getenv('DATA_DIR', 'data')
+# LINE 圖片、語音以區塊串流下載；超過 MEDIA_SPOOL_BYTES 的內容暫存到磁碟 (MEDIA_TEMP_DIR，預設為系統暫存目錄)
+media_chunk_bytes = int(os.getenv('MEDIA_CHUNK_BYTES', str(256 * 1024)))
+media_spool_bytes = int(os.getenv('MEDIA_SPOOL_BYTES', str(4 * 1024 * 1024)))
+media_temp_dir = os.getenv('MEDIA_TEMP_DIR') or None
+# Drive 可續傳上傳的區塊大小 (需為 256 KiB 的倍數)；超過一個區塊的檔案才使用可續傳上傳
+drive_upload_chunk_bytes = max(1, int(os.getenv('DRIVE_UPLOAD_CHUNK_BYTES', str(8 * 1024 * 1024))) // (256 * 1024)) * 256 * 1024
+drive_upload_retries = int(os.getenv('DRIVE_UPLOAD_RETRIES', '3'))
 
 # Google Drive 權限範圍
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
@@ -71,11 +150,274 @@ if channel_secret is None or channel_access_token is None:
     print('請在 .env 檔案中設定 LINE_CHANNEL_SECRET 與 LINE_CHANNEL_ACCESS_TOKEN')
     sys.exit(1)
 
-configuration = Configuration(access_token=channel_access_token)
+configuration = Configuration(access_token=channel_access_token, host=os.getenv('LINE_API_HOST', 'https://api.line.me'))
 handler = WebhookHandler(channel_secret)
-client = OpenAI(api_key=openai_api_key) if openai_api_key else None
-notion = Client(auth=notion_api_key) if notion_api_key else None
-apify_client = ApifyClient(apify_api_key) if apify_api_key else None
+line_client = LineClient(
+    configuration,
+    pool_size=int(os.getenv('LINE_POOL_SIZE', '20')),
+    max_concurrency=int(os.getenv('LINE_MAX_CONCURRENCY', '10')),
+    data_host=os.getenv('LINE_DATA_API_HOST', 'https://api-data.line.me')
+)
+# OpenAI、Notion、Apify 用戶端在第一次使用時才匯入套件並建立 (未設定金鑰時為 None)
+client = LazyClient('openai', lambda: load('openai').AsyncOpenAI(api_key=openai_api_key)) if openai_api_key else None
+notion = LazyClient('notion', lambda: load('notion_client').AsyncClient(
+    auth=notion_api_key, base_url=os.getenv('NOTION_BASE_URL', 'https://api.notion.com')
+)) if notion_api_key else None
+apify_client = LazyClient('apify', lambda: load('apify_client').ApifyClientAsync(
+    apify_api_key, api_url=os.getenv('APIFY_API_URL') or None
+)) if apify_api_key else None
+# 一般網頁擷取使用的 HTTP 用戶端 (共用連線池)
+http_client = httpx.AsyncClient(
+    follow_redirects=True,
+    timeout=float(os.getenv('HTTP_FETCH_TIMEOUT_SECONDS', '30')),
+    headers={'User-Agent': 'Mozilla/5.0 (compatible; LinebotInspirationAssistant/0.1)'}
+)
+job_queue = JobQueue(worker_count=job_queue_workers, maxsize=job_queue_maxsize)
+# 多個 worker 程序 (uvicorn --workers) 或多台機器共用的協調後端：sqlite:///path 或 redis://host:6379/0
+# 未設定時所有狀態僅存在於目前程序
+coordinator = create_coordinator(os.getenv('COORDINATION_URL'))
+
+def rate_limiter(name, rate):
+    """建立限流器；有協調後端時所有程序共用同一個權杖桶"""
+    if coordinator is not None:
+        return SharedTokenBucket(coordinator, name, rate)
+    return TokenBucket(rate=rate)
+
+# 各外部服務的保護層 (逾時、自適應並行上限、抖動退避重試、斷路器)，可用 UPSTREAM_<NAME>_* 環境變數調整
+circuit_failure_threshold = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+circuit_reset_seconds = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+
+def make_upstream(name, timeout, max_concurrency, retries=0):
+    prefix = f"UPSTREAM_{name.upper()}_"
+    return Upstream(
+        name,
+        timeout=float(os.getenv(f"{prefix}TIMEOUT_SECONDS", str(timeout))),
+        max_concurrency=int(os.getenv(f"{prefix}MAX_CONCURRENCY", str(max_concurrency))),
+        retries=int(os.getenv(f"{prefix}RETRIES", str(retries))),
+        failure_threshold=circuit_failure_threshold,
+        reset_timeout=circuit_reset_seconds
+    )
+
+# OpenAI、Apify 與 Notion 的 SDK 或寫入器本身已有重試，Drive 建立檔案不是冪等操作，預設只重試 LINE 內容下載
+upstreams = {
+    "openai": make_upstream("openai", 120, 8),
+    "apify": make_upstream("apify", 180, 4),
+    "notion": make_upstream("notion", 30, 4),
+    "drive": make_upstream("drive", 60, 4),
+    "line": make_upstream("line", 60, 10, retries=2),
+}
+# Apify Actor 以非同步方式啟動並輪詢，只取回需要的筆數；APIFY_ACTOR_OPTIONS 為 JSON，依 Actor 設定記憶體與逾時
+apify_runner = ApifyRunner(
+    apify_client,
+    timeout=float(os.getenv('APIFY_RUN_TIMEOUT_SECONDS', '150')),
+    poll_interval=float(os.getenv('APIFY_POLL_INTERVAL_SECONDS', '5')),
+    actor_options=json.loads(os.getenv('APIFY_ACTOR_OPTIONS') or '{}')
+) if apify_client else None
+
+openai_rate_limit = float(os.getenv('OPENAI_RATE_LIMIT_PER_SECOND', '0'))
+# OpenAI 呼叫限流 (0 表示不限制)
+openai_rate_limiter = rate_limiter('openai', openai_rate_limit) if openai_rate_limit > 0 else None
+# webhook 重新投遞去重 (以 webhookEventId / message.id 為鍵)；設定 DEDUP_SQLITE_PATH 啟用持久層
+deduplicator = EventDeduplicator(
+    max_entries=int(os.getenv('DEDUP_MAX_ENTRIES', '10000')),
+    ttl=int(os.getenv('DEDUP_TTL_SECONDS', '86400')),
+    sqlite_path=os.getenv('DEDUP_SQLITE_PATH') or None,
+    coordinator=coordinator
+)
+# 網址擷取結果快取 (依來源設定不同 TTL，重複分享的網址不必再跑 Apify)
+extraction_cache = ExtractionCache(
+    os.getenv('URL_CACHE_PATH', os.path.join(data_dir, 'extraction_cache.sqlite3')),
+    ttls={
+        "facebook": int(os.getenv('URL_CACHE_TTL_FACEBOOK', '21600')),
+        "threads": int(os.getenv('URL_CACHE_TTL_THREADS', '21600')),
+        "web": int(os.getenv('URL_CACHE_TTL_WEB', '86400')),
+    },
+    max_entries=int(os.getenv('URL_CACHE_MAX_ENTRIES', '1000')),
+    max_bytes=int(os.getenv('URL_CACHE_MAX_BYTES', str(50 * 1024 * 1024))),
+    shared=coordinator
+)
+# Notion 寫入器 (分批寫入區塊、共用限流、失敗時存入本地 outbox)
+notion_outbox_retry_interval = float(os.getenv('NOTION_OUTBOX_RETRY_SECONDS', '300'))
+notion_writer = NotionWriter(
+    notion,
+    rate_limiter('notion', float(os.getenv('NOTION_RATE_LIMIT_PER_SECOND', '3'))),
+    os.getenv('NOTION_OUTBOX_PATH', os.path.join(data_dir, 'notion_outbox.sqlite3')),
+    max_retries=int(os.getenv('NOTION_MAX_RETRIES', '5')),
+    upstream=upstreams["notion"],
+    max_outbox_attempts=int(os.getenv('NOTION_OUTBOX_MAX_ATTEMPTS', '10'))
+) if notion else None
+# Notion 資料庫增量同步 (需安裝 pyarrow；NOTION_SYNC_INTERVAL_SECONDS 為 0 時停用)
+notion_sync_interval = float(os.getenv('NOTION_SYNC_INTERVAL_SECONDS', '0'))
+notion_sync = NotionSync(
+    notion,
+    notion_database_id,
+    os.getenv('NOTION_SYNC_DIR', os.path.join(data_dir, 'notion_sync')),
+    request=notion_writer.request,
+    concurrency=int(os.getenv('NOTION_SYNC_CONCURRENCY', '3'))
+) if notion_writer and notion_database_id and notion_sync_interval > 0 else None
+# 語音轉錄 (長錄音依靜音處切段並行轉錄)
+audio_transcriber = AudioTranscriber(
+    model="whisper-1",
+    language="zh",
+    prompt="以下是繁體中文的對話內容：",
+    chunk_seconds=int(os.getenv('AUDIO_CHUNK_SECONDS', '60')),
+    threshold_seconds=int(os.getenv('AUDIO_CHUNK_THRESHOLD_SECONDS', '120')),
+    concurrency=int(os.getenv('AUDIO_TRANSCRIBE_CONCURRENCY', '4')),
+    rate_limiter=openai_rate_limiter,
+    upstream=upstreams["openai"]
+)
+# 一般網頁擷取策略 (本地 trafilatura 優先，必要時對沖升級到 Apify)
+fetch_engine = FetchStrategyEngine(
+    hedge_delay=float(os.getenv('FETCH_HEDGE_DELAY_SECONDS', '4')),
+    min_chars=int(os.getenv('FETCH_MIN_CONTENT_CHARS', '200')),
+    stats_path=os.path.join(data_dir, 'fetch_strategy_stats.json')
+)
+fetch_stats_flush_interval = float(os.getenv('FETCH_STATS_FLUSH_SECONDS', '30'))
+# 網址來源註冊表：依網域分派擷取器，新增來源 (例如 YouTube、X) 只需再註冊一筆
+url_router = UrlRouter(default=Extractor("web", lambda url: crawl_web_page(url), "網頁筆記", "web"))
+url_router.register(("facebook.com", "fb.watch"), Extractor("facebook", lambda url: crawl_facebook_post(url), "FB 筆記", "social"))
+url_router.register(("threads.net", "threads.com"), Extractor("threads", lambda url: crawl_threads_post(url), "Threads 筆記", "social"))
+# 每則訊息最多處理的網址數與同時擷取數
+url_max_per_message = int(os.getenv('URL_MAX_PER_MESSAGE', '10'))
+url_extract_concurrency = int(os.getenv('URL_EXTRACT_CONCURRENCY', '3'))
+# 摘要快取 (相同內容、提示詞類型與模型不再重複呼叫 LLM)；設定 SUMMARY_CACHE_PATH 啟用磁碟層
+summary_cache = SummaryCache(
+    max_entries=int(os.getenv('SUMMARY_CACHE_MAX_ENTRIES', '500')),
+    disk_path=os.getenv('SUMMARY_CACHE_PATH') or None,
+    shared=coordinator
+)
+# 持久化工作紀錄 (每個事件已完成的階段與中間結果)，重啟後從中斷處繼續
+job_store = JobStore(
+    os.getenv('JOB_STORE_PATH', os.path.join(data_dir, 'jobs.sqlite3')),
+    max_attempts=int(os.getenv('JOB_STORE_MAX_ATTEMPTS', '3'))
+)
+job_store_retention = int(os.getenv('JOB_STORE_RETENTION_SECONDS', str(7 * 86400)))
+# 本地筆記索引 (每次存入 Notion 時同步新增)，供 /s 指令搜尋；嵌入後端：openai 或 hashing (本地、不需金鑰)
+note_index_embedder = os.getenv('NOTE_INDEX_EMBEDDER', 'openai' if client else 'hashing')
+note_index = NoteIndex(
+    os.getenv('NOTE_INDEX_PATH', os.path.join(data_dir, 'notes.sqlite3')),
+    OpenAIEmbedder(
+        client,
+        model=os.getenv('NOTE_INDEX_EMBEDDING_MODEL', 'text-embedding-3-small'),
+        rate_limiter=openai_rate_limiter,
+        upstream=upstreams["openai"]
+    ) if note_index_embedder == 'openai' else HashingEmbedder(int(os.getenv('NOTE_INDEX_HASHING_DIM', '512'))),
+    ann_threshold=int(os.getenv('NOTE_INDEX_ANN_THRESHOLD', '5000'))
+)
+note_search_results = int(os.getenv('NOTE_SEARCH_RESULTS', '5'))
+# 長文摘要 (超過單次上限時切段並行摘要再合併，最終摘要以串流取得)
+summarizer = MapReduceSummarizer(
+    summary_model,
+    single_pass_tokens=int(os.getenv('SUMMARY_SINGLE_PASS_TOKENS', '6000')),
+    chunk_tokens=int(os.getenv('SUMMARY_CHUNK_TOKENS', '3000')),
+    overlap_tokens=int(os.getenv('SUMMARY_CHUNK_OVERLAP_TOKENS', '200')),
+    concurrency=int(os.getenv('SUMMARY_MAP_CONCURRENCY', '4')),
+    rate_limiter=openai_rate_limiter,
+    upstream=upstreams["openai"]
+)
+# 同一次 webhook 或短時間窗口內的網址合併成一次 Apify 執行 (多個 startUrls)，Notion 寫入也一併分批
+apify_batch_window = float(os.getenv('APIFY_BATCH_WINDOW_SECONDS', '0.2'))
+apify_batch_max_urls = int(os.getenv('APIFY_BATCH_MAX_URLS', '10'))
+web_crawl_batcher = MicroBatcher(lambda urls: crawl_general_urls(urls), window=apify_batch_window, max_size=apify_batch_max_urls)
+facebook_crawl_batcher = MicroBatcher(lambda urls: crawl_facebook_posts(urls), window=apify_batch_window, max_size=apify_batch_max_urls)
+notion_batcher = MicroBatcher(
+    lambda pages: notion_writer.create_pages(pages),
+    window=float(os.getenv('NOTION_BATCH_WINDOW_SECONDS', '0.2')),
+    max_size=int(os.getenv('NOTION_BATCH_MAX_PAGES', '10'))
+)
+# token.json 儲存使用者的存取與更新權杖
+drive_manager = DriveClientManager(
+    SCOPES,
+    token_path=os.getenv('GOOGLE_TOKEN_PATH', 'token.json'),
+    discovery_path=os.getenv('GOOGLE_DRIVE_DISCOVERY_PATH'),
+    root_url=os.getenv('GOOGLE_DRIVE_ROOT_URL') or None,
+    refresh_margin=int(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS', '300')),
+    coordinator=coordinator
+)
+
+# 啟動後於背景預先載入的整合 (逗號分隔，all 表示全部)：openai、notion、apify、drive、trafilatura
+WARMUP_LOADERS = {
+    "openai": lambda: client.get() if client else None,
+    "notion": lambda: notion.get() if notion else None,
+    "apify": lambda: apify_client.get() if apify_client else None,
+    "drive": lambda: drive_manager.preload(),
+    "trafilatura": lambda: load('trafilatura'),
+}
+warmup_setting = os.getenv('WARMUP_CLIENTS', '').strip()
+warmup_targets = list(WARMUP_LOADERS) if warmup_setting == 'all' else [
+    name.strip() for name in warmup_setting.split(',') if name.strip()
+]
+
+async def warm_up(names):
+    """逐一在執行緒中匯入套件並建立用戶端，讓第一個事件不必等待匯入"""
+    for name in names:
+        loader = WARMUP_LOADERS.get(name)
+        if loader is None:
+            print(f"Unknown warm-up target: {name}")
+            continue
+        try:
+            await asyncio.to_thread(loader)
+        except Exception as e:
+            print(f"Error warming up {name}: {e}")
+    print(f"Warm-up finished: {format_timings()}")
+
+# Prometheus 指標：佇列、去重、快取與 Notion outbox 的即時數值
+registry.gauge('linebot_job_queue', '背景工作佇列狀態', lambda: {(("stat", k),): v for k, v in job_queue.stats().items()})
+registry.gauge('linebot_jobs', '持久化工作紀錄狀態', lambda: {(("status", k),): v for k, v in job_store.stats().items()})
+registry.gauge('linebot_dedup', '事件去重統計', lambda: {(("stat", k),): v for k, v in deduplicator.stats().items()})
+registry.gauge('linebot_cache', '擷取與摘要快取統計', lambda: {
+    (("cache", name), ("stat", k)): v
+    for name, cache in (("extraction", extraction_cache), ("summary", summary_cache))
+    for k, v in cache.stats().items()
+})
+registry.gauge('linebot_batch', '批次合併統計', lambda: {
+    (("batcher", name), ("stat", k)): v
+    for name, batcher in batchers().items()
+    for k, v in batcher.stats().items()
+})
+registry.gauge('linebot_upstream', '外部服務保護層狀態 (state：0 closed、1 half_open、2 open)', lambda: {
+    (("upstream", name), ("stat", k)): ({"closed": 0, "half_open": 1, "open": 2}[v] if k == "state" else v)
+    for name, upstream in upstreams.items()
+    for k, v in upstream.stats().items()
+})
+registry.gauge('linebot_import_seconds', '各模組第一次匯入的耗時 (秒)', lambda: {
+    (("module", name),): seconds for name, seconds in import_timings.items()
+})
+registry.gauge('linebot_notion_outbox_pending', '等待重送的 Notion 寫入數', lambda: {(): notion_writer.pending_count() if notion_writer else 0})
+registry.gauge('linebot_notion_dead_letter', '不再重送的 Notion 寫入數 (內容錯誤或超過重送上限)', lambda: {(): notion_writer.dead_letter_count() if notion_writer else 0})
+if os.getenv('METRICS_OTEL_ENABLED', 'false').lower() == 'true':
+    enable_opentelemetry()
+
+def batchers():
+    return {"apify_web": web_crawl_batcher, "apify_facebook": facebook_crawl_batcher, "notion": notion_batcher}
+
+def event_job_id(event):
+    """以 webhookEventId 作為工作 id (舊格式事件則使用 message id)"""
+    webhook_event_id = getattr(event, 'webhook_event_id', None)
+    if webhook_event_id:
+        return webhook_event_id
+    message = getattr(event, 'message', None)
+    if message is not None and getattr(message, 'id', None):
+        return f"message:{message.id}"
+    return None
+
+async def resume_unfinished_jobs(started_at):
+    """將啟動前未完成的工作重新排入佇列 (啟動後才收到的事件由 /callback 正常處理)"""
+    purged = job_store.purge(job_store_retention)
+    if purged:
+        print(f"Purged {purged} finished jobs")
+    for job_id, event_json in job_store.unfinished(started_at):
+        # 多個 worker 共用同一份工作紀錄時，只由搶到的程序補回
+        if coordinator is not None and not await asyncio.to_thread(coordinator.add, f"resume:{job_id}", str(os.getpid()), 600):
+            continue
+        try:
+            event = Event.from_json(event_json)
+        except Exception as e:
+            print(f"Error restoring job {job_id}: {e}")
+            job_store.fail(job_id, e)
+            continue
+        print(f"Resuming unfinished job {job_id}")
+        await job_queue.put(dispatch_events, [event])
 
 def is_allowed(user_id):
     """檢查使用者是否在白名單中"""
@@ -83,81 +425,158 @@ def is_allowed(user_id):
         return True  # 若未設定則預設允許 (或可改為 False 增加安全性)
     return user_id == allowed_line_id
 
+async def send_reply(event, text):
+    """回覆文字訊息；若 reply token 已逾時或失效則改用 push message"""
+    token_age = time.time() - event.timestamp / 1000
+    if event.reply_token and token_age < reply_token_ttl:
+        try:
+            await line_client.reply_message(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[TextMessage(text=text)]
+                )
+            )
+            return
+        except ApiException as e:
+            print(f"Reply failed, falling back to push message: {e}")
+    await line_client.push_message(
+        PushMessageRequest(
+            to=event.source.user_id,
+            messages=[TextMessage(text=text)]
+        )
+    )
+
 def get_drive_service():
-    """獲取 Google Drive 服務實例 (OAuth 2.0)"""
-    creds = None
-    # token.json 儲存使用者的存取與更新權杖
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    
-    # 如果沒有有效憑證，則執行登入流程
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(GoogleRequest())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # 儲存憑證供下次使用
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    """獲取 Google Drive 服務實例 (OAuth 2.0，憑證與 service 皆由 drive_manager 快取)"""
+    return drive_manager.get_service()
 
-    return build('drive', 'v3', credentials=creds)
+def check_upload_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise TimeoutError("Drive upload abandoned")
 
-def upload_to_drive(file_content, filename, folder_id):
-    """將檔案上傳到 Google Drive 並設定為公開連結"""
-    try:
-        service = get_drive_service()
-        file_metadata = {
-            'name': filename,
-            'parents': [folder_id]
-        }
-        media = MediaIoBaseUpload(io.BytesIO(file_content), mimetype='image/jpeg')
-        file = service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute()
-        
-        # 設定檔案權限為任何擁有連結的人皆可檢視
+def upload_resumable(request, cancelled=None):
+    """分段送出可續傳上傳；暫時性錯誤後再次呼叫 next_chunk 會從伺服器已收到的位置繼續，不重新上傳整個檔案
+
+    cancelled (threading.Event) 被設定時在下一個分段前停止；最後一個分段送出前檔案尚未建立，不會留下孤兒檔案。
+    """
+    response = None
+    interruptions = 0
+    while response is None:
+        check_upload_cancelled(cancelled)
+        try:
+            _, response = request.next_chunk(num_retries=drive_upload_retries)
+        except Exception as e:
+            interruptions += 1
+            if not is_transient(e) or interruptions > drive_upload_retries:
+                raise
+            delay = min(30, 2 ** interruptions)
+            print(f"Drive upload interrupted ({e}), resuming in {delay}s")
+            if cancelled is not None:
+                # 等待期間被取消時立即醒來，於下一輪開頭結束
+                cancelled.wait(delay)
+            else:
+                time.sleep(delay)
+    return response
+
+def upload_to_drive(media, filename, folder_id, mimetype='image/jpeg', cancelled=None):
+    """將 MediaBuffer 的內容上傳到 Google Drive 並設定為公開連結 (失敗時拋出例外)
+
+    cancelled (threading.Event) 被設定時停止上傳；檔案已建立則刪除，不留下公開分享的檔案。
+    """
+    service = get_drive_service()
+    file_metadata = {
+        'name': filename,
+        'parents': [folder_id]
+    }
+    with span("drive_upload"), media.open() as reader:
+        # 從獨立的讀取器分段讀取，不把整個檔案複製進記憶體
+        resumable = media.size > drive_upload_chunk_bytes
+        body = load('googleapiclient.http').MediaIoBaseUpload(
+            reader, mimetype=mimetype, chunksize=drive_upload_chunk_bytes, resumable=resumable
+        )
+        request = service.files().create(body=file_metadata, media_body=body, fields='id, webViewLink')
+        # 小檔案一次送出 (建立檔案不是冪等操作，不自動重試)
+        file = upload_resumable(request, cancelled) if resumable else request.execute()
+        if cancelled is not None and cancelled.is_set():
+            service.files().delete(fileId=file.get('id')).execute()
+            check_upload_cancelled(cancelled)
+    
+        # 設定檔案權限為任何擁有連結的人皆可檢視 (不需回傳欄位，只取 id 減少回應大小)
         service.permissions().create(
             fileId=file.get('id'),
-            body={'type': 'anyone', 'role': 'reader'}
+            body={'type': 'anyone', 'role': 'reader'},
+            fields='id'
         ).execute()
-        
-        # 再次獲取檔案以獲取 webViewLink (有時建立時拿不到正確的 webViewLink)
-        file = service.files().get(fileId=file.get('id'), fields='webViewLink').execute()
-        return file.get('webViewLink')
+    
+        # 建立時已取得 webViewLink，只有缺少時才再查詢一次
+        web_view_link = file.get('webViewLink')
+        if not web_view_link:
+            file = service.files().get(fileId=file.get('id'), fields='webViewLink').execute()
+            web_view_link = file.get('webViewLink')
+    return web_view_link
+
+async def upload_image_to_drive(media, filename, mimetype):
+    """在執行緒中上傳 Drive (受 upstreams["drive"] 保護)；逾時或斷路器開啟時回傳 None，直接回覆上傳失敗"""
+    async def attempt():
+        cancelled = threading.Event()
+        try:
+            return await asyncio.to_thread(upload_to_drive, media, filename, google_drive_folder_id, mimetype, cancelled)
+        finally:
+            # 逾時後 worker 不再等待：通知執行緒在下一個分段前停止，避免繼續上傳或留下孤兒檔案
+            cancelled.set()
+
+    # 可續傳上傳依分段數放寬逾時，每個分段各有一次基本逾時
+    chunks = max(1, -(-media.size // drive_upload_chunk_bytes))
+    try:
+        return await upstreams["drive"].call(attempt, timeout=upstreams["drive"].timeout * chunks)
     except Exception as e:
         print(f"Error uploading to Drive: {e}")
         return None
 
-def analyze_image(image_bytes):
-    """使用 OpenAI Vision API 辨識圖片內容"""
+def prepare_media_for_vision(media):
+    # 以獨立的讀取器解碼 (大圖直接從暫存檔讀取)，與 Drive 上傳互不干擾
+    with media.open() as reader:
+        return prepare_vision_image(reader, vision_image_detail)
+
+async def analyze_image(media):
+    """使用 OpenAI Vision API 辨識圖片內容 (media 為 MediaBuffer)；失敗時回傳 None (不會被記錄為已完成的階段)"""
     if not client:
-        return "OpenAI API 未設定"
+        return None
     try:
-        # 將圖片轉為 base64
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        # 縮成 Vision 實際會使用的解析度再轉為 base64 (原圖仍完整上傳 Drive)；解碼屬於 CPU 工作，丟到執行緒
+        with span("image_preprocess"):
+            vision_bytes, mimetype, detail = await asyncio.to_thread(prepare_media_for_vision, media)
+        base64_image = base64.b64encode(vision_bytes).decode('utf-8')
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "這是一張筆記或靈感圖片，請仔細辨識圖片內容，並將其中的文字或主要物件總結成一段繁體中文摘要，以便我記錄到 Notion。"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
+        with span("vision"):
+            # 第一次使用時在執行緒中匯入 openai，不阻塞事件迴圈
+            await resolve(client)
+            if openai_rate_limiter:
+                await openai_rate_limiter.acquire()
+            response = await upstreams["openai"].call(
+                client.chat.completions.create,
+                model="gpt-4o-mini",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": "這是一張筆記或靈感圖片，請仔細辨識圖片內容，並將其中的文字或主要物件總結成一段繁體中文摘要，以便我記錄到 Notion。"},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{mimetype};base64,{base64_image}",
+                                    "detail": detail,
+                                },
                             },
-                        },
-                    ],
-                }
-            ],
-            max_tokens=500,
-        )
+                        ],
+                    }
+                ],
+                max_tokens=500,
+            )
         return response.choices[0].message.content
     except Exception as e:
         print(f"Error analyzing image: {e}")
-        return f"圖片分析出錯: {e}"
+        return None
 
 @app.post("/callback")
 async def callback(request: Request):
@@ -170,20 +589,133 @@ async def callback(request: Request):
     body = await request.body()
     body_text = body.decode('utf-8')
 
-    # 驗證簽章並處理事件
+    # 驗證簽章並解析事件 (實際處理交給背景 worker，立即回應 LINE)
     try:
-        handler.handle(body_text, signature)
+        with span("signature_verify", note_type="webhook"):
+            events = handler.parser.parse(body_text, signature)
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
+    new_events = []
+    claimed = []
+    job_ids = []
+    for event in events:
+        # 重新投遞或處理中的重複事件在進入佇列前就略過，避免重複呼叫外部服務
+        # 去重可能查詢 SQLite 或協調後端 (Redis)，在執行緒中進行以免阻塞事件迴圈
+        if not await asyncio.to_thread(deduplicator.claim, event):
+            print(f"Skipping duplicate event {getattr(event, 'webhook_event_id', '')}")
+            continue
+        claimed.append(event)
+        # 先寫入持久化工作紀錄再排入佇列；已有紀錄代表重啟前已收過此事件 (會由啟動時的補回流程處理)
+        # 沒有處理函式的事件 (貼圖、影片、follow、postback 等) 不需記錄
+        job_id = event_job_id(event) if find_handler(event) is not None else None
+        if job_id is not None:
+            if not job_store.add(job_id, event.to_json()):
+                print(f"Skipping already recorded event {job_id}")
+                continue
+            job_ids.append(job_id)
+        new_events.append(event)
+
+    if new_events:
+        # 同一次投遞的事件作為一個工作並行處理，讓網址擷取與 Notion 寫入能合併成批次
+        try:
+            job_queue.submit(dispatch_events, new_events)
+        except asyncio.QueueFull:
+            # 佇列已滿時回傳 503，讓 LINE 稍後重新投遞
+            for job_id in job_ids:
+                job_store.discard(job_id)
+            for event in claimed:
+                await asyncio.to_thread(deduplicator.release, event)
+            raise HTTPException(status_code=503, detail="Job queue is full")
+
     return 'OK'
 
-def summarize_text(text, type="general"):
+@app.get("/queue/metrics")
+async def queue_metrics():
+    stats = job_queue.stats()
+    stats["dedup"] = deduplicator.stats()
+    stats["jobs"] = job_store.stats()
+    stats["note_index"] = note_index.stats()
+    if notion_sync:
+        stats["notion_sync"] = notion_sync.stats()
+    stats["upstreams"] = {name: upstream.stats() for name, upstream in upstreams.items()}
+    if apify_runner:
+        stats["apify_runs"] = apify_runner.stats()
+    stats["batch"] = {name: batcher.stats() for name, batcher in batchers().items()}
+    return stats
+
+@app.get("/cache/metrics")
+async def cache_metrics():
+    return {
+        "extraction": extraction_cache.stats(),
+        "summary": summary_cache.stats(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Prometheus 文字格式
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def find_handler(event):
+    """依事件與訊息類型找出 handler 註冊的處理函式 (沒有時回傳 None)"""
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handler._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+    if func is None:
+        func = handler._handlers.get(event.__class__.__name__, handler._default)
+    return func
+
+async def dispatch_event(event):
+    """找出事件的處理函式並執行"""
+    func = find_handler(event)
+    if func is None:
+        print(f"No handler for {event.__class__.__name__}")
+        # 先前版本可能已記錄此類事件，標記完成以免每次啟動都被補回
+        job_id = event_job_id(event)
+        if job_id is not None:
+            job_store.complete(job_id)
+        return
+    # worker 會重複使用同一個 context，每個事件開始前重設筆記類型標籤與工作 id
+    job_id = event_job_id(event)
+    token = current_note_type.set("unknown")
+    job_token = current_job_id.set(job_id)
+    if job_id is not None:
+        job_store.start(job_id)
+    try:
+        if asyncio.iscoroutinefunction(func):
+            await func(event)
+        else:
+            # 相容同步的處理函式
+            await asyncio.to_thread(func, event)
+    except Exception as e:
+        if job_id is not None:
+            job_store.fail(job_id, e)
+        raise
+    else:
+        if job_id is not None:
+            job_store.complete(job_id)
+    finally:
+        current_job_id.reset(job_token)
+        current_note_type.reset(token)
+
+async def dispatch_events(events):
+    """並行處理同一次 webhook 投遞的所有事件，任一事件失敗時於全部完成後拋出"""
+    if len(events) == 1:
+        await dispatch_event(events[0])
+        return
+    results = await asyncio.gather(*(dispatch_event(event) for event in events), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        print(f"Error handling event: {error}")
+    if errors:
+        raise errors[0]
+
+async def summarize_text(text, type="general"):
     if not client:
         return ""
     try:
         # 使用台灣時間
-        now_tw = datetime.now(TW_TIMEZONE)
+        now_tw = taiwan_now()
         
         # 根據類型選擇提示詞
         prompts = {
@@ -192,122 +724,198 @@ def summarize_text(text, type="general"):
             "web": "請幫我摘要這段網頁文章內容，抓出重點：",
             "general": "請幫我摘要這段文字內容，抓出重點："
         }
-        prompt_prefix = prompts.get(type, prompts["general"])
+        prompt_type = type if type in prompts else "general"
+        prompt_prefix = prompts[prompt_type]
+
+        # 相同內容與提示詞類型近期已摘要過，直接使用快取結果
+        # 快取的磁碟層與共用層 (SQLite / Redis) 在執行緒中查詢
+        cached = await asyncio.to_thread(summary_cache.get, text, prompt_type, summary_model)
+        if cached is not None:
+            print("Summary cache hit")
+            return cached
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You are a helpful assistant. The current time is {now_tw.strftime('%Y-%m-%d %H:%M:%S')} (Asia/Taipei)."},
-                {"role": "user", "content": f"{prompt_prefix}\n\n{text}"}
-            ]
-        )
-        return response.choices[0].message.content
+        # 短內容單次呼叫；長內容由 summarizer 切段並行摘要後合併，最終結果以串流逐步取得
+        system_prompt = f"You are a helpful assistant. The current time is {now_tw.strftime('%Y-%m-%d %H:%M:%S')} (Asia/Taipei)."
+        parts = []
+        with span("summary"):
+            started_at = time.perf_counter()
+            # 每次 OpenAI 呼叫 (map、合併與最終串流) 由 summarizer 各自套用 upstream 保護
+            await resolve(client)
+            async for delta in summarizer.stream(client, text, prompt_prefix, system_prompt):
+                if not parts:
+                    # 記錄第一個 token 的延遲
+                    stage_duration.observe(time.perf_counter() - started_at, stage="summary_first_token",
+                                           note_type=current_note_type.get(), outcome="success")
+                parts.append(delta)
+        summary = ''.join(parts)
+        if summary:
+            await asyncio.to_thread(summary_cache.set, text, prompt_type, summary_model, summary)
+        return summary
     except Exception as e:
         print(f"Error summarizing text: {e}")
         return ""
 
-def extract_url_content(url):
+def extract_main_text(html):
+    # trafilatura (含 lxml 與語言資料) 第一次使用時才在執行緒中載入
+    return load('trafilatura').extract(html)
+
+async def extract_url_content(url):
     """擷取網頁內容並提取文字"""
     try:
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded:
-            content = trafilatura.extract(downloaded)
-            return content
-        return None
+        with span("trafilatura") as stage:
+            response = await http_client.get(url)
+            response.raise_for_status()
+            downloaded = response.text
+            if downloaded:
+                # trafilatura 解析屬於 CPU 工作，丟到執行緒避免阻塞事件迴圈
+                content = await asyncio.to_thread(extract_main_text, downloaded)
+                if not content:
+                    stage.outcome = "empty"
+                return content
+            stage.outcome = "empty"
+            return None
     except Exception as e:
         print(f"Error extracting URL content: {e}")
         return None
 
-def crawl_facebook_post(url):
-    """使用 Apify 爬取 Facebook 貼文內容"""
-    if not apify_client:
-        print("Apify API key not set.")
-        return None
+async def extract_with_cache(url, source, fetch):
+    """先查詢擷取快取，未命中才實際爬取並寫回快取"""
+    cached = await asyncio.to_thread(extraction_cache.get, url)
+    if cached is not None:
+        print(f"Extraction cache hit: {url}")
+        return cached
+    content = await fetch()
+    if content:
+        await asyncio.to_thread(extraction_cache.set, url, source, content)
+    return content
+
+async def run_apify_actor(actor_id, run_input, max_items=None):
+    """以 apify_runner 執行 Actor 並取回前 max_items 筆結果 (並行上限與斷路器由 upstreams["apify"] 控制)"""
+    # 外層逾時比 Actor 執行上限多保留一些時間，讓 runner 自行中止執行並取回部分結果
+    return await upstreams["apify"].call(
+        apify_runner.run, actor_id, run_input, max_items=max_items,
+        timeout=apify_runner.timeout_for(actor_id) + 30
+    )
+
+def match_items_to_urls(urls, items, url_fields):
+    """依結果中的網址欄位將 Apify 批次結果對應回各輸入網址 (單一網址時直接取第一筆)"""
+    if len(urls) == 1:
+        return [items[0] if items else None]
+    by_url = {}
+    for item in items:
+        for field in url_fields:
+            value = item.get(field)
+            if value:
+                by_url.setdefault(canonicalize_url(value), item)
+    return [by_url.get(canonicalize_url(url)) for url in urls]
+
+def format_facebook_post(post):
+    """將 facebook-posts-scraper 的結果組合成筆記內容"""
+    # 組合貼文內容 (根據 Apify 實際輸出結構調整)
+    # 優先使用 pageName, 其次是 user.name
+    author = post.get('pageName') or post.get('user', {}).get('name') or "未知發布者"
+    
+    # 優先使用 text, 其次是 message
+    text_content = post.get('text') or post.get('message') or "(無文字內容)"
+    
+    content = f"【Facebook 貼文內容】\n"
+    content += f"發布者: {author}\n"
+    content += f"發布時間: {post.get('time', post.get('timestamp', '未知'))}\n"
+    content += f"內容: {text_content}\n"
+    
+    # 如果內容為空，提示可能是權限問題
+    if text_content == "(無文字內容)":
+        content += "\n(註：若內容為空，可能是因為貼文非公開、來自私密社團，或該網址為分享短網址。建議提供標準永久連結且確保貼文設為公開。)\n"
     
+    return content
+
+async def crawl_facebook_posts(urls):
+    """使用 Apify 一次爬取多篇 Facebook 貼文，回傳與 urls 順序相同的內容清單"""
+    # 同一批內重複的網址只爬一次
+    unique_urls = list(dict.fromkeys(urls))
     try:
-        # 準備輸入參數
+        # 準備輸入參數 (每個網址各取一篇貼文)
         run_input = {
-            "startUrls": [{"url": url}],
+            "startUrls": [{"url": url} for url in unique_urls],
             "resultsLimit": 1,
             "maxPosts": 1,
             "maxComments": 0,
             "proxy": {"useApifyProxy": True}
         }
         
-        # 執行 Actor (apify/facebook-posts-scraper)
-        run = apify_client.actor("apify/facebook-posts-scraper").call(run_input=run_input)
-        
-        # 取得結果
-        items = list(apify_client.dataset(run["defaultDatasetId"]).iterate_items())
-        if items:
-            post = items[0]
-            # 組合貼文內容 (根據 Apify 實際輸出結構調整)
-            # 優先使用 pageName, 其次是 user.name
-            author = post.get('pageName') or post.get('user', {}).get('name') or "未知發布者"
-            
-            # 優先使用 text, 其次是 message
-            text_content = post.get('text') or post.get('message') or "(無文字內容)"
-            
-            content = f"【Facebook 貼文內容】\n"
-            content += f"發布者: {author}\n"
-            content += f"發布時間: {post.get('time', post.get('timestamp', '未知'))}\n"
-            content += f"內容: {text_content}\n"
-            
-            # 如果內容為空，提示可能是權限問題
-            if text_content == "(無文字內容)":
-                content += "\n(註：若內容為空，可能是因為貼文非公開、來自私密社團，或該網址為分享短網址。建議提供標準永久連結且確保貼文設為公開。)\n"
-            
-            return content
-        return None
+        # 執行 Actor (apify/facebook-posts-scraper) 並取得結果 (每個網址一篇，筆數到齊即停止)
+        with span("apify"):
+            items = await run_apify_actor("apify/facebook-posts-scraper", run_input, max_items=len(unique_urls))
+        posts = dict(zip(unique_urls, match_items_to_urls(unique_urls, items, ("inputUrl", "facebookUrl", "url"))))
     except Exception as e:
         print(f"Error crawling Facebook: {e}")
-        return None
+        posts = {}
+    return [format_facebook_post(posts[url]) if posts.get(url) else None for url in urls]
 
-def crawl_general_url(url):
-    """使用 Apify 爬取一般網頁內容"""
+async def crawl_facebook_post(url):
+    """使用 Apify 爬取 Facebook 貼文內容 (短時間內的多個網址會合併成一次執行)"""
     if not apify_client:
         print("Apify API key not set.")
         return None
-    
+    return await facebook_crawl_batcher.submit(url)
+
+async def crawl_general_urls(urls):
+    """使用 Apify 一次爬取多個一般網頁，回傳與 urls 順序相同的內容清單"""
+    # 同一批內重複的網址只爬一次
+    unique_urls = list(dict.fromkeys(urls))
     try:
-        # 準備輸入參數 (使用 website-content-crawler)
+        # 準備輸入參數 (使用 website-content-crawler，只抓輸入的頁面、不往下爬)
         run_input = {
-            "startUrls": [{"url": url}],
-            "maxCrawlPages": 1,
+            "startUrls": [{"url": url} for url in unique_urls],
+            "maxCrawlPages": len(unique_urls),
+            "maxCrawlDepth": 0,
             "onlySubdomain": True,
             "removeCookieWarnings": True,
         }
         
-        # 執行 Actor
-        run = apify_client.actor("apify/website-content-crawler").call(run_input=run_input)
-        
-        # 取得結果
-        items = list(apify_client.dataset(run["defaultDatasetId"]).iterate_items())
-        if items:
-            # 提取主要內容
-            return items[0].get('markdown') or items[0].get('text')
-        return None
+        # 執行 Actor 並取得結果
+        with span("apify"):
+            items = await run_apify_actor("apify/website-content-crawler", run_input, max_items=len(unique_urls))
+        pages = dict(zip(unique_urls, match_items_to_urls(unique_urls, items, ("url",))))
     except Exception as e:
         print(f"Error crawling general URL: {e}")
+        pages = {}
+    # 提取主要內容
+    return [(pages[url].get('markdown') or pages[url].get('text')) if pages.get(url) else None for url in urls]
+
+async def crawl_general_url(url):
+    """使用 Apify 爬取一般網頁內容 (短時間內的多個網址會合併成一次執行)"""
+    if not apify_client:
+        print("Apify API key not set.")
         return None
+    if not upstreams["apify"].available:
+        # Apify 異常時立即失敗，由擷取策略直接採用 trafilatura 的結果
+        raise CircuitOpenError("apify")
+    return await web_crawl_batcher.submit(url)
 
-def crawl_threads_post(url):
+async def crawl_web_page(url):
+    """一般網頁：先跑本地 trafilatura，內容不足或超過對沖延遲才同時啟動 Apify，取先完成的合格結果"""
+    return await fetch_engine.fetch(
+        url,
+        local=lambda: extract_url_content(url),
+        remote=lambda: crawl_general_url(url)
+    )
+
+async def crawl_threads_post(url):
     """使用 Apify 爬取 Threads 貼文內容"""
     if not apify_client:
         print("Apify API key not set.")
         return None
     
     try:
-        # 準備輸入參數 (根據 sinam7/threads-post-scraper 格式)
+        # 準備輸入參數 (根據 sinam7/threads-post-scraper 格式)；Actor 只接受 threads.net 網域
         run_input = {
-            "url": url
+            "url": url.replace("threads.com", "threads.net")
         }
         
-        # 執行 Actor
-        run = apify_client.actor(threads_actor_id).call(run_input=run_input)
-        
-        # 取得結果
-        items = list(apify_client.dataset(run["defaultDatasetId"]).iterate_items())
+        # 執行 Actor 並取得結果 (只使用第一筆)
+        with span("apify"):
+            items = await run_apify_actor(threads_actor_id, run_input, max_items=1)
         if items:
             post = items[0]
             # 更新解析邏輯 (sinam7 格式)
@@ -329,39 +937,43 @@ def crawl_threads_post(url):
         print(f"Error crawling Threads: {e}")
         return None
 
-def save_to_notion(text, summary, note_type="語音筆記", url=None, line_id=None):
-    if not notion or not notion_database_id:
-        print("Notion setup incomplete, skipping save.")
-        return
-
+async def save_to_notion(text, summary, note_type="語音筆記", url=None, line_id=None, extra_urls=None):
+    """寫入 Notion 並回傳頁面 id (失敗時回傳 None，內容保留在 outbox 稍後重送)"""
     # 使用台灣時間
-    now_tw = datetime.now(TW_TIMEZONE)
+    now_tw = taiwan_now()
     current_time = now_tw.isoformat()
     title = f"{note_type} [{now_tw.strftime('%Y-%m-%d %H:%M')}]"
 
+    if not notion or not notion_database_id:
+        print("Notion setup incomplete, skipping save.")
+        await index_note(text, summary, note_type, url, line_id, None, title)
+        return None
+
     try:
         # 準備頁面內容 (Children)
         children = []
         
-        # 如果有 URL，先加入連結區塊
+        # 如果有 URL，先加入連結區塊 (同一則訊息的多個網址各一個連結)
         if url:
             children.append({
                 "object": "block",
                 "type": "heading_2",
                 "heading_2": {"rich_text": [{"text": {"content": "連結"}}]}
             })
-            children.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {"content": "查看連結", "link": {"url": url}}
-                        }
-                    ]
-                }
-            })
+            links = [url] + list(extra_urls or [])
+            for i, link in enumerate(links, start=1):
+                children.append({
+                    "object": "block",
+                    "type": "paragraph",
+                    "paragraph": {
+                        "rich_text": [
+                            {
+                                "type": "text",
+                                "text": {"content": "查看連結" if len(links) == 1 else f"查看連結 {i}", "link": {"url": link}}
+                            }
+                        ]
+                    }
+                })
 
         children.append({
             "object": "block",
@@ -380,10 +992,15 @@ def save_to_notion(text, summary, note_type="語音筆記", url=None, line_id=No
                 }
             })
 
-        # 準備屬性
+        # 準備屬性 (rich_text 每段同樣有 2000 字元限制，長摘要拆成多段)
+        summary_text = summary or ""
+        summary_rich_text = [
+            {"text": {"content": summary_text[i:i+1800]}}
+            for i in range(0, len(summary_text), 1800)
+        ] or [{"text": {"content": ""}}]
         properties = {
             "Name": {"title": [{"text": {"content": title}}]},
-            "摘要": {"rich_text": [{"text": {"content": summary}}]},
+            "摘要": {"rich_text": summary_rich_text},
             "時間": {"date": {"start": current_time, "end": None}},
             "類型": {"select": {"name": note_type}}
         }
@@ -396,115 +1013,212 @@ def save_to_notion(text, summary, note_type="語音筆記", url=None, line_id=No
         if line_id:
             properties["Line_ID"] = {"rich_text": [{"text": {"content": line_id}}]}
 
-        notion.pages.create(
-            parent={"database_id": notion_database_id},
-            properties=properties,
-            children=children
-        )
-        print("Successfully saved to Notion")
+        # 超過 100 個區塊時由 notion_writer 以 blocks.children.append 分批補上；
+        # 短時間內的多筆筆記合併成一批依序寫入
+        with span("notion_write") as stage:
+            page_id = await notion_batcher.submit({
+                "parent": {"database_id": notion_database_id},
+                "properties": properties,
+                "children": children
+            })
+            if not page_id:
+                stage.outcome = "error"
+        if page_id:
+            print("Successfully saved to Notion")
     except Exception as e:
         print(f"Failed to save to Notion: {e}")
+        page_id = None
+    # 寫入失敗存入 outbox 的筆記同樣加入本地索引，仍可搜尋
+    await index_note(text, summary, note_type, url, line_id, page_id, title)
+    return page_id
+
+async def index_note(text, summary, note_type, url, line_id, page_id, title):
+    """將筆記加入本地索引 (以工作 id 為鍵，工作重跑時覆寫同一筆)；失敗不影響存檔"""
+    try:
+        with span("note_index"):
+            await note_index.add(
+                current_job_id.get() or uuid.uuid4().hex, text, summary, note_type,
+                line_id=line_id, url=url, page_id=page_id, title=title
+            )
+    except Exception as e:
+        print(f"Error indexing note: {e}")
+
+def format_search_results(query, results):
+    """將搜尋結果整理成 LINE 回覆文字"""
+    if not results:
+        return f"找不到與「{query}」相關的筆記。"
+    lines = [f"【筆記搜尋】{query}"]
+    for i, note in enumerate(results, start=1):
+        summary = (note["summary"] or "").strip().replace("\n", " ")
+        if len(summary) > 80:
+            summary = summary[:80] + "…"
+        lines.append(f"\n{i}. {note['title'] or note['note_type']} (相似度 {note['score']:.2f})")
+        if summary:
+            lines.append(summary)
+        if note["url"]:
+            lines.append(note["url"])
+        if note["page_id"]:
+            lines.append(f"https://www.notion.so/{note['page_id'].replace('-', '')}")
+    return "\n".join(lines)
+
+async def download_media(message_id):
+    """以區塊串流下載 LINE 內容到 MediaBuffer (受 upstreams["line"] 保護，重試時重新寫入)；用完需呼叫 close()"""
+    media = MediaBuffer(spool_bytes=media_spool_bytes, directory=media_temp_dir)
+
+    async def download():
+        media.reset()
+        await line_client.download_message_content(message_id, media, chunk_size=media_chunk_bytes)
+        media.finish()
+
+    try:
+        with span("line_download"):
+            await upstreams["line"].call(download)
+    except BaseException:
+        media.close()
+        raise
+    return media
 
 @handler.add(MessageEvent, message=ImageMessageContent)
-def handle_image_message(event):
+async def handle_image_message(event):
     if not is_allowed(event.source.user_id):
-        with ApiClient(configuration) as api_client:
-            line_messaging_api = MessagingApi(api_client)
-            line_messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="抱歉，您沒有權限使用此服務。")]
-                )
-            )
+        await send_reply(event, "抱歉，您沒有權限使用此服務。")
         return
 
-    with ApiClient(configuration) as api_client:
-        line_messaging_api = MessagingApi(api_client)
-        line_messaging_api_blob = MessagingApiBlob(api_client)
-        
-        # 1. 向使用者表示正在處理
-        # line_messaging_api.reply_message(
-        #     ReplyMessageRequest(
-        #         reply_token=event.reply_token,
-        #         messages=[TextMessage(text="收到圖片！正在處理中，請稍候...")]
-        #     )
-        # )
-        # 注意：LINE 一個 reply_token 只能回覆一次，所以前面不能先回覆。
-        
-        # 2. 獲取圖片內容
-        message_content = line_messaging_api_blob.get_message_content(event.message.id)
-        
-        # 3. 分析圖片 (OpenAI Vision)
-        analysis_result = analyze_image(message_content)
-        
-        # 4. 上傳至 Google Drive
-        now_tw = datetime.now(TW_TIMEZONE)
-        filename = f"image_{now_tw.strftime('%Y%m%d_%H%M%S')}.jpg"
-        drive_link = upload_to_drive(message_content, filename, google_drive_folder_id)
-        
-        if drive_link:
-            # 5. 儲存到 Notion
-            save_to_notion(analysis_result, analysis_result, note_type="圖片筆記", url=drive_link, line_id=event.source.user_id)
-            reply_text = f"【圖片辨識摘要】\n{analysis_result}\n\n【雲端連結】\n{drive_link}"
-        else:
-            reply_text = f"【圖片辨識摘要】\n{analysis_result}\n\n(注意：圖片上傳雲端失敗)"
-        
-        # 6. 回傳結果
-        line_messaging_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=reply_text)]
+    current_note_type.set("圖片筆記")
+
+    # 1. 獲取圖片內容 (串流寫入 MediaBuffer，大圖暫存到磁碟)
+    # 注意：LINE 一個 reply_token 只能回覆一次，所以不先回覆「處理中」。
+    media = await download_media(event.message.id)
+    try:
+        reply_text = await process_image(event, media)
+    finally:
+        media.close()
+
+    # 4. 回傳結果 (reply token 逾時則改用 push)
+    await send_reply(event, reply_text)
+
+async def process_image(event, media):
+    """圖片分析、上傳 Drive 並存入 Notion，回傳回覆文字"""
+    # 依檔頭判斷實際格式 (LINE 可能傳 PNG、HEIC 等)，Drive 保留原檔與正確的類型
+    mimetype, extension = sniff_image_format(media.head())
+    now_tw = taiwan_now()
+    filename = f"image_{now_tw.strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+    async def save_note(vision, drive):
+        # 只有分析與上傳都成功才寫入 Notion (需要摘要與雲端連結)
+        if vision and drive:
+            await job_store.run_stage(
+                "notion",
+                lambda: save_to_notion(vision, vision, note_type="圖片筆記", url=drive, line_id=event.source.user_id)
             )
+
+    # 2. 圖片分析 (OpenAI Vision) 與上傳 Google Drive 只依賴圖片內容，並行執行；
+    #    Google Drive 用戶端為同步 API，改在執行緒中執行
+    # 3. 兩者完成後才寫入 Notion
+    graph = (
+        StageGraph()
+        .add("vision", lambda content: job_store.run_stage("vision", lambda: analyze_image(content)), after=["content"])
+        .add("drive", lambda content: job_store.run_stage(
+            "drive", lambda: upload_image_to_drive(content, filename, mimetype)
+        ), after=["content"])
+        .add("notion", save_note, after=["vision", "drive"])
+    )
+    results = await graph.run(content=media)
+    analysis_result = results["vision"]
+    drive_link = results["drive"]
+    if not analysis_result:
+        # 錯誤訊息只用於回覆，不寫入工作紀錄或 Notion
+        analysis_result = "圖片分析出錯，請稍後再傳一次。" if client else "OpenAI API 未設定"
+
+    if drive_link:
+        return f"【圖片辨識摘要】\n{analysis_result}\n\n【雲端連結】\n{drive_link}"
+    return f"【圖片辨識摘要】\n{analysis_result}\n\n(注意：圖片上傳雲端失敗)"
+
+async def extract_urls(urls):
+    """並行擷取多個網址 (同時最多 url_extract_concurrency 個)，依原順序回傳 [(網址, 擷取器, 內容)]"""
+    semaphore = asyncio.Semaphore(url_extract_concurrency)
+
+    async def extract(index, url):
+        async with semaphore:
+            try:
+                # 短網址 (如 fb.watch) 先解析轉址；擷取與寫入 Notion 都使用原網址，
+                # 正規化網址只作為擷取快取的鍵與批次結果的比對 (移除參數可能指向不同頁面)
+                if needs_redirect_resolution(url):
+                    url = await resolve_redirects(url, http_client)
+                extractor = url_router.route(url)
+                current_note_type.set(extractor.note_type)
+                content = await job_store.run_stage(
+                    f"extract:{index}", lambda: extract_with_cache(url, extractor.name, lambda: extractor.fetch(url))
+                )
+            except Exception as e:
+                print(f"Error extracting {url}: {e}")
+                return url, url_router.route(url), None
+            return url, extractor, content
+
+    return await asyncio.gather(*(extract(index, url) for index, url in enumerate(urls)))
+
+async def summarize_urls(urls, line_id):
+    """擷取、摘要並存入 Notion；多個網址合併成一份內容，回傳回覆文字"""
+    results = await extract_urls(urls)
+    extracted = [(url, extractor, content) for url, extractor, content in results if content]
+    if not extracted:
+        return "無法擷取該網址的內容。"
+
+    if len(extracted) == 1:
+        url, extractor, content = extracted[0]
+        note_type, summary_type = extractor.note_type, extractor.summary_type
+    else:
+        note_types = {extractor.note_type for _, extractor, _ in extracted}
+        summary_types = {extractor.summary_type for _, extractor, _ in extracted}
+        note_type = note_types.pop() if len(note_types) == 1 else "多連結筆記"
+        summary_type = summary_types.pop() if len(summary_types) == 1 else "web"
+        content = "\n\n".join(
+            f"【來源 {i}】{url}\n{text}" for i, (url, _, text) in enumerate(extracted, start=1)
+        )
+    current_note_type.set(note_type)
+
+    # 摘要內容並儲存到 Notion (第一個網址為 URL 屬性，其餘加入連結區塊)
+    summary = await job_store.run_stage("summary", lambda: summarize_text(content, type=summary_type))
+    await job_store.run_stage(
+        "notion", lambda: save_to_notion(
+            content, summary, note_type=note_type, url=extracted[0][0], line_id=line_id,
+            extra_urls=[url for url, _, _ in extracted[1:]]
         )
+    )
+    reply_text = f"【{note_type}摘要】\n{summary}"
+    failed = len(results) - len(extracted)
+    if failed:
+        reply_text += f"\n\n(另有 {failed} 個網址無法擷取)"
+    return reply_text
 
 @handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event):
+async def handle_message(event):
     if not is_allowed(event.source.user_id):
-        with ApiClient(configuration) as api_client:
-            line_messaging_api = MessagingApi(api_client)
-            line_messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="抱歉，您沒有權限使用此服務。")]
-                )
-            )
+        await send_reply(event, "抱歉，您沒有權限使用此服務。")
         return
 
     text = event.message.text.strip()
     
-    # 網址偵測邏輯 (簡單的正則表達式)
-    url_pattern = r'https?://[^\s]+'
-    url_match = re.search(url_pattern, text)
+    # 取出訊息中所有網址，並行擷取後合併成一份摘要與一個 Notion 頁面
+    urls = find_urls(text, limit=url_max_per_message)
     
-    if url_match:
-        url = url_match.group(0)
-        # 判斷網址類型
-        if "facebook.com" in url or "fb.watch" in url:
-            content = crawl_facebook_post(url)
-            note_type = "FB 筆記"
-        elif "threads.net" in url or "threads.com" in url:
-            # 自動修正網域並使用 Threads 專用爬蟲
-            clean_url = url.replace("threads.com", "threads.net")
-            content = crawl_threads_post(clean_url)
-            note_type = "Threads 筆記"
-        else:
-            # 先試試 Apify，失敗則回退到 trafilatura
-            content = crawl_general_url(url)
-            if not content:
-                content = extract_url_content(url)
-            note_type = "網頁筆記"
-
-        if content:
-            # 2. 摘要內容
-            # 根據筆記類型決定摘要提示詞類型
-            summary_type = "social" if "FB" in note_type or "Threads" in note_type else "web"
-            summary = summarize_text(content, type=summary_type)
-            # 3. 儲存到 Notion
-            save_to_notion(content, summary, note_type=note_type, url=url, line_id=event.source.user_id)
-            reply_text = f"【{note_type}摘要】\n{summary}"
-        else:
-            reply_text = "無法擷取該網址的內容。"
+    if urls:
+        reply_text = await summarize_urls(urls, event.source.user_id)
     
+    # 指令 /s：搜尋自己過去的筆記 (本地索引，不呼叫 Notion)
+    elif text.lower().startswith("/s"):
+        query = text[2:].strip()
+        if not query:
+            reply_text = "請在 /s 後方輸入要搜尋的關鍵字。"
+        else:
+            try:
+                with span("note_search"):
+                    results = await note_index.search(query, k=note_search_results, line_id=event.source.user_id)
+                reply_text = format_search_results(query, results)
+            except Exception as e:
+                print(f"Error searching notes: {e}")
+                reply_text = "搜尋筆記時發生錯誤，請稍後再試。"
+
     # 檢查是否包含指令 /a
     elif text.lower().startswith("/a"):
         # 移除指令部分取得純文本
@@ -512,84 +1226,62 @@ def handle_message(event):
         if not content:
             reply_text = "請在 /a 後方輸入要摘要的文字。"
         else:
-            summary = summarize_text(content, type="general")
-            save_to_notion(content, summary, note_type="文字摘要", line_id=event.source.user_id)
+            current_note_type.set("文字摘要")
+            summary = await job_store.run_stage("summary", lambda: summarize_text(content, type="general"))
+            await job_store.run_stage(
+                "notion", lambda: save_to_notion(content, summary, note_type="文字摘要", line_id=event.source.user_id)
+            )
             reply_text = f"【AI 摘要】\n{summary}"
     else:
         # 一般訊息處理 (Echo)
         reply_text = text
 
-    with ApiClient(configuration) as api_client:
-        line_messaging_api = MessagingApi(api_client)
-        line_messaging_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=reply_text)]
-            )
-        )
+    await send_reply(event, reply_text)
 
 @handler.add(MessageEvent, message=AudioMessageContent)
-def handle_audio_message(event):
+async def handle_audio_message(event):
     if not is_allowed(event.source.user_id):
-        with ApiClient(configuration) as api_client:
-            line_messaging_api = MessagingApi(api_client)
-            line_messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="抱歉，您沒有權限使用此服務。")]
-                )
-            )
+        await send_reply(event, "抱歉，您沒有權限使用此服務。")
         return
 
     if client is None:
-        with ApiClient(configuration) as api_client:
-            line_messaging_api = MessagingApi(api_client)
-            line_messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="抱歉，系統尚未設定 OpenAI API Key，無法處理語音訊息。")]
-                )
-            )
+        await send_reply(event, "抱歉，系統尚未設定 OpenAI API Key，無法處理語音訊息。")
         return
 
-    with ApiClient(configuration) as api_client:
-        line_messaging_api = MessagingApi(api_client)
-        line_messaging_api_blob = MessagingApiBlob(api_client)
-        
-        # 1. 取得語音內容
-        message_content = line_messaging_api_blob.get_message_content(event.message.id)
-        
-        # 2. 存入暫存檔並交由 Whisper 識別
-        # LINE 語音訊息通常是 m4a/aac 格式
-        with tempfile.NamedTemporaryFile(suffix='.m4a', delete=True) as tf:
-            tf.write(message_content)
-            tf.flush()
-            
-            with open(tf.name, "rb") as audio_file:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1", 
-                    file=audio_file,
-                    language="zh",
-                    prompt="以下是繁體中文的對話內容："
+    current_note_type.set("語音筆記")
+
+    async def transcribe():
+        # 1. 取得語音內容 (串流下載)
+        with await download_media(event.message.id) as media:
+            # 2. 交由 Whisper 識別 (上限 25 MB)；暫存在磁碟的錄音直接從檔案上傳或交給 ffmpeg 解碼，不先讀進記憶體
+            # LINE 語音訊息通常是 m4a/aac 格式；長錄音會切段並行轉錄
+            with span("whisper") as stage:
+                # 每個片段的轉錄由 audio_transcriber 各自套用 upstream 保護
+                await resolve(client)
+                transcript = await audio_transcriber.transcribe(
+                    client, media, duration_ms=event.message.duration, filename='audio.m4a'
                 )
+                if not transcript:
+                    stage.outcome = "empty"
+        return transcript
 
-        # 儲存到 Notion
-        if transcript and transcript.text:
-            summary = summarize_text(transcript.text, type="audio")
-            save_to_notion(transcript.text, summary, note_type="語音筆記", line_id=event.source.user_id)
-            
-            # 回覆內容包含摘要
-            reply_text = f"【辨識結果】\n{transcript.text}\n\n【AI 摘要】\n{summary}"
-        else:
-            reply_text = "無法辨識語音內容。"
-        
-        # 3. 回傳辨識結果
-        line_messaging_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=reply_text)]
-            )
+    # 重啟後若已轉錄過，直接使用紀錄中的逐字稿 (不重新下載與轉錄)
+    transcript_text = await job_store.run_stage("transcript", transcribe)
+
+    # 儲存到 Notion
+    if transcript_text:
+        summary = await job_store.run_stage("summary", lambda: summarize_text(transcript_text, type="audio"))
+        await job_store.run_stage(
+            "notion", lambda: save_to_notion(transcript_text, summary, note_type="語音筆記", line_id=event.source.user_id)
         )
+        
+        # 回覆內容包含摘要
+        reply_text = f"【辨識結果】\n{transcript_text}\n\n【AI 摘要】\n{summary}"
+    else:
+        reply_text = "無法辨識語音內容。"
+    
+    # 3. 回傳辨識結果 (reply token 逾時則改用 push)
+    await send_reply(event, reply_text)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import shutil
+import wave
+from array import array
+
+# 轉成 Whisper 建議的 16kHz 單聲道 16-bit PCM 後再切段
+SAMPLE_RATE = 16000
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+async def decode_to_pcm(media, sample_rate=SAMPLE_RATE):
+    """以 ffmpeg 將任意音訊 (LINE 為 m4a/aac) 解碼成單聲道 16-bit PCM
+
+    media 為 MediaBuffer：暫存在磁碟的錄音由 ffmpeg 直接讀取檔案，記憶體中的內容才經由 stdin 傳入。
+    """
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', media.path if media.on_disk else 'pipe:0',
+        '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1',
+        stdin=asyncio.subprocess.DEVNULL if media.on_disk else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    pcm, stderr = await process.communicate(None if media.on_disk else media.read())
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed: {stderr.decode('utf-8', 'ignore').strip()}")
+    return pcm
+
+
+def _quietest_frame(samples, start, end, frame):
+    """在 [start, end) 範圍中找出平均振幅最低的音框起點"""
+    best_offset, best_energy = start, None
+    for offset in range(start, max(start + 1, end - frame), frame):
+        window = samples[offset:offset + frame]
+        if not window:
+            break
+        energy = sum(abs(s) for s in window) / len(window)
+        if best_energy is None or energy < best_energy:
+            best_offset, best_energy = offset, energy
+    return best_offset
+
+
+def find_split_points(pcm, sample_rate=SAMPLE_RATE, chunk_seconds=60, search_seconds=10, frame_ms=30):
+    """回傳切段的樣本位置；每段約 chunk_seconds，於目標點前後 search_seconds 內找最安靜處下刀"""
+    samples = array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    total = len(samples)
+    chunk = int(chunk_seconds * sample_rate)
+    search = int(search_seconds * sample_rate)
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    points = [0]
+    # 只計算目標切點附近的能量，避免掃描整段錄音
+    while total - points[-1] > chunk + search:
+        target = points[-1] + chunk
+        points.append(_quietest_frame(samples, max(points[-1] + frame, target - search), min(total, target + search), frame))
+    points.append(total)
+    return points
+
+
+def pcm_to_wav(pcm, name, sample_rate=SAMPLE_RATE):
+    """將 PCM 片段封裝成 WAV (記憶體內)"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    buffer.seek(0)
+    buffer.name = name
+    return buffer
+
+
+class AudioTranscriber:
+    """Whisper 轉錄：短錄音直接上傳，長錄音依靜音處切段後並行轉錄再依序合併"""
+
+    def __init__(self, model='whisper-1', language='zh', prompt=None,
+                 chunk_seconds=60, threshold_seconds=120, concurrency=4, rate_limiter=None, upstream=None):
+        self.model = model
+        self.language = language
+        self.prompt = prompt
+        self.chunk_seconds = chunk_seconds
+        # 錄音長度超過此秒數 (且有 ffmpeg) 才切段
+        self.threshold_seconds = threshold_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # 可選的共用限流器 (具備 async acquire())，多個 worker 程序共用 OpenAI 配額時使用
+        self.rate_limiter = rate_limiter
+        # 可選的 resilience.Upstream：每個片段的轉錄各自套用逾時、並行上限與斷路器
+        self.upstream = upstream
+
+    async def _create(self, client, name, audio_file):
+        # 以 (檔名, 檔案物件) 上傳：Whisper 依副檔名判斷格式，暫存檔的路徑沒有副檔名
+        options = {"model": self.model, "file": (name, audio_file), "language": self.language}
+        if self.prompt:
+            options["prompt"] = self.prompt
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        # 重試時從頭重新上傳
+        audio_file.seek(0)
+        transcript = await client.audio.transcriptions.create(**options)
+        return transcript.text or ""
+
+    async def _transcribe_file(self, client, name, audio_file):
+        async with self._semaphore:
+            if self.upstream is not None:
+                return await self.upstream.call(self._create, client, name, audio_file)
+            return await self._create(client, name, audio_file)
+
+    async def transcribe(self, client, media, duration_ms=None, filename='audio.m4a'):
+        """轉錄音訊 (media 為 MediaBuffer) 並回傳文字"""
+        long_recording = duration_ms is not None and duration_ms / 1000 > self.threshold_seconds
+        if not long_recording or not ffmpeg_available():
+            # 直接上傳讀取器：暫存在磁碟的錄音由檔案串流送出，不先讀進記憶體
+            with media.open() as reader:
+                return await self._transcribe_file(client, filename, reader)
+
+        pcm = await decode_to_pcm(media)
+        points = await asyncio.to_thread(find_split_points, pcm, SAMPLE_RATE, self.chunk_seconds)
+        chunks = [
+            pcm_to_wav(pcm[start * 2:end * 2], f"chunk_{i:03d}.wav")
+            for i, (start, end) in enumerate(zip(points, points[1:]))
+        ]
+        print(f"Transcribing {len(chunks)} audio chunks concurrently")
+        texts = await asyncio.gather(*(self._transcribe_file(client, chunk.name, chunk) for chunk in chunks))
+        return "\n".join(text.strip() for text in texts if text.strip())
@@ -0,0 +1,77 @@
+import asyncio
+
+
+class MicroBatcher:
+    """將短時間窗口內的多個請求合併成一次批次呼叫 (例如同一次 webhook 轉傳的多個網址)
+
+    batch_func 接收項目清單，回傳與輸入順序相同的結果清單。
+    """
+
+    def __init__(self, batch_func, window=0.2, max_size=10):
+        self.batch_func = batch_func
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+
+    async def submit(self, item):
+        """加入目前的批次並等待該項目的結果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # 等待期間已取消的呼叫端不再送出
+        batch = [(item, future) for item, future in batch if not future.cancelled()]
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            # 保留參考避免工作在完成前被回收
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            for _, future in batch:
+                future.add_done_callback(lambda _, batch=batch, task=task: self._cancel_if_abandoned(batch, task))
+
+    @staticmethod
+    def _cancel_if_abandoned(batch, task):
+        """批次中所有呼叫端都已取消時 (例如對沖擷取的另一方先完成)，取消批次呼叫本身 (例如中止 Apify 執行)"""
+        if not task.done() and all(future.cancelled() for _, future in batch):
+            task.cancel()
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        self.batches += 1
+        self.items += len(items)
+        self.max_batch_size = max(self.max_batch_size, len(items))
+        try:
+            results = await self.batch_func(items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            # 呼叫端可能已取消 (例如對沖擷取的另一方先完成)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "pending": len(self._pending),
+        }
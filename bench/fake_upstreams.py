@@ -0,0 +1,277 @@
+"""本地外部服務替身：模擬 LINE、OpenAI、Notion、Apify、Google Drive 與一般網頁，可設定延遲、錯誤率與 429 行為"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from array import array
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+
+SERVICES = ("line", "openai", "notion", "apify", "drive", "web")
+
+SUMMARY_TEXT = "這是模擬的摘要重點：記錄靈感、定期回顧。"
+
+ARTICLE_PARAGRAPH = (
+    "靈感往往出現在最意想不到的時刻，記錄下來並定期回顧，才能把零散的想法累積成有價值的作品。"
+    "這篇文章整理了幾個實用的筆記方法，包括每日摘要、主題標籤與定期回顧。"
+)
+
+
+class UpstreamBehavior:
+    """單一服務的模擬行為：平均延遲 (秒)、抖動比例、錯誤率與 429 比例"""
+
+    def __init__(self, latency=0.0, jitter=0.2, error_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+    def sample_latency(self):
+        if self.latency <= 0:
+            return 0.0
+        return max(0.0, random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+
+
+def classify(path):
+    """依路徑判斷請求屬於哪個外部服務"""
+    if path.startswith("/v2/bot/"):
+        return "line"
+    if path.startswith(("/v1/chat", "/v1/audio", "/v1/embeddings")):
+        return "openai"
+    if path.startswith(("/v1/pages", "/v1/blocks", "/v1/databases")):
+        return "notion"
+    if path.startswith(("/v2/acts", "/v2/actor-runs", "/v2/datasets")):
+        return "apify"
+    if path.startswith(("/upload/drive", "/drive")):
+        return "drive"
+    return "web"
+
+
+def _apify_run(run_id, dataset_id, actor_id):
+    now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+    return {
+        "id": run_id,
+        "actId": actor_id,
+        "status": "SUCCEEDED",
+        "startedAt": now,
+        "finishedAt": now,
+        "defaultDatasetId": dataset_id,
+        "defaultKeyValueStoreId": f"kvs-{run_id}",
+        "defaultRequestQueueId": f"rq-{run_id}",
+    }
+
+
+def create_app(behaviors=None, media_bytes=200_000, article_paragraphs=8):
+    behaviors = behaviors or {}
+    app = FastAPI()
+    apify_runs = {}
+    media_payload = random.randbytes(media_bytes)
+    app.state.request_counts = {service: 0 for service in SERVICES}
+
+    @app.middleware("http")
+    async def simulate(request: Request, call_next):
+        service = classify(request.url.path)
+        app.state.request_counts[service] += 1
+        behavior = behaviors.get(service)
+        if behavior:
+            await asyncio.sleep(behavior.sample_latency())
+            roll = random.random()
+            if roll < behavior.rate_limit_rate:
+                return JSONResponse(
+                    {"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited (simulated)"},
+                    status_code=429,
+                    headers={"Retry-After": str(behavior.retry_after)}
+                )
+            if roll < behavior.rate_limit_rate + behavior.error_rate:
+                return JSONResponse(
+                    {"object": "error", "status": 500, "code": "internal_server_error", "message": "Injected failure"},
+                    status_code=500
+                )
+        return await call_next(request)
+
+    # LINE Messaging API
+    @app.post("/v2/bot/message/reply")
+    @app.post("/v2/bot/message/push")
+    async def line_send(request: Request):
+        await request.body()
+        return {"sentMessages": [{"id": str(random.randint(1, 10**12)), "quoteToken": "bench"}]}
+
+    @app.get("/v2/bot/message/{message_id}/content")
+    async def line_content(message_id: str):
+        return Response(media_payload, media_type="application/octet-stream")
+
+    # OpenAI
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model", "gpt-4o-mini")
+        if body.get("stream"):
+            async def events():
+                # 以 server-sent events 逐字送出，模擬串流回應
+                for i, piece in enumerate(SUMMARY_TEXT):
+                    delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(0)
+                done = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": SUMMARY_TEXT},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body.get("input")
+        if isinstance(texts, str):
+            texts = [texts]
+        dimensions = body.get("dimensions") or 256
+        data = []
+        for i, text in enumerate(texts):
+            # 相同文字得到相同向量，讓 /s 搜尋在測試中也有穩定結果
+            rng = random.Random(hashlib.sha256(str(text).encode('utf-8')).digest())
+            vector = [rng.uniform(-1, 1) for _ in range(dimensions)]
+            if body.get("encoding_format") == "base64":
+                # openai SDK 預設以 base64 (little-endian float32) 取得向量
+                embedding = base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": 10 * len(texts), "total_tokens": 10 * len(texts)},
+        }
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request):
+        await request.body()
+        return {"text": "這是一段模擬的語音轉文字內容，用來測試整體流程的效能。"}
+
+    # Notion
+    @app.post("/v1/pages")
+    async def notion_create_page(request: Request):
+        await request.body()
+        return {"object": "page", "id": str(uuid.uuid4())}
+
+    @app.patch("/v1/blocks/{block_id}/children")
+    async def notion_append_children(block_id: str, request: Request):
+        await request.body()
+        return {"object": "list", "results": [], "next_cursor": None, "has_more": False}
+
+    # Apify
+    @app.post("/v2/acts/{actor_id}/runs")
+    async def apify_start(actor_id: str, request: Request):
+        body = await request.body()
+        # apify-client 以 gzip 壓縮 run input
+        if request.headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        run_input = json.loads(body or b"{}")
+        run_id = uuid.uuid4().hex
+        dataset_id = uuid.uuid4().hex
+        urls = [item.get("url") for item in run_input.get("startUrls", [])] or [run_input.get("url")]
+        apify_runs[run_id] = _apify_run(run_id, dataset_id, actor_id)
+        apify_runs[dataset_id] = [
+            {"url": url, "text": ARTICLE_PARAGRAPH * 5, "markdown": ARTICLE_PARAGRAPH * 5,
+             "content": ARTICLE_PARAGRAPH, "pageName": "模擬粉專", "authorId": "/@bench"}
+            for url in urls
+        ]
+        return JSONResponse({"data": apify_runs[run_id]}, status_code=201)
+
+    @app.get("/v2/actor-runs/{run_id}")
+    async def apify_run(run_id: str):
+        return {"data": apify_runs[run_id]}
+
+    @app.post("/v2/actor-runs/{run_id}/abort")
+    async def apify_abort(run_id: str):
+        return {"data": {**apify_runs[run_id], "status": "ABORTED"}}
+
+    @app.get("/v2/datasets/{dataset_id}/items")
+    async def apify_items(dataset_id: str, offset: int = 0, limit: int = 1000):
+        items = apify_runs.get(dataset_id, [])
+        page = items[offset:offset + limit]
+        headers = {
+            "x-apify-pagination-total": str(len(items)),
+            "x-apify-pagination-offset": str(offset),
+            "x-apify-pagination-count": str(len(page)),
+            "x-apify-pagination-limit": str(limit),
+            "x-apify-pagination-desc": "false",
+        }
+        return JSONResponse(page, headers=headers)
+
+    # Google Drive
+    @app.post("/upload/drive/v3/files")
+    async def drive_upload(request: Request):
+        await request.body()
+        file_id = uuid.uuid4().hex
+        return {"id": file_id, "webViewLink": f"https://drive.google.com/file/d/{file_id}/view"}
+
+    @app.post("/drive/v3/files/{file_id}/permissions")
+    async def drive_permission(file_id: str, request: Request):
+        await request.body()
+        return {"id": "anyoneWithLink"}
+
+    @app.get("/drive/v3/files/{file_id}")
+    async def drive_get(file_id: str):
+        return {"id": file_id, "webViewLink": f"https://drive.google.com/file/d/{file_id}/view"}
+
+    # 一般網頁
+    @app.get("/article/{article_id}")
+    async def article(article_id: str):
+        paragraphs = "".join(f"<p>{ARTICLE_PARAGRAPH} ({article_id}-{i})</p>" for i in range(article_paragraphs))
+        return HTMLResponse(
+            f"<html><head><title>Article {article_id}</title></head>"
+            f"<body><article><h1>靈感筆記 {article_id}</h1>{paragraphs}</article></body></html>"
+        )
+
+    return app
+
+
+class FakeUpstreamServer:
+    """在背景執行緒中啟動替身伺服器"""
+
+    def __init__(self, behaviors=None, host="127.0.0.1", port=8765, media_bytes=200_000, article_paragraphs=8):
+        self.app = create_app(behaviors, media_bytes=media_bytes, article_paragraphs=article_paragraphs)
+        self.host = host
+        self.port = port
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout=10):
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake upstream server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
@@ -0,0 +1,336 @@
+"""離線效能測試：以本地替身取代所有外部服務，送出簽章過的 LINE webhook 並量測吞吐量、各階段延遲與記憶體用量
+
+用法：
+    python bench/run_benchmark.py --requests 500 --concurrency 50 --latency openai=0.8 --latency notion=0.3
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_upstreams import SERVICES, FakeUpstreamServer, UpstreamBehavior  # noqa: E402
+from metrics import stage_duration  # noqa: E402
+
+CHANNEL_SECRET = "bench-channel-secret"
+USER_ID = "Ubench000000000000000000000000000"
+MESSAGE_KINDS = ("text", "summary", "url", "audio", "image")
+
+
+def parse_service_values(values, cast=float):
+    """解析 `service=value` 形式的參數，service 可為 all"""
+    result = {}
+    for item in values or []:
+        service, _, value = item.partition('=')
+        targets = SERVICES if service == 'all' else (service,)
+        for target in targets:
+            if target not in SERVICES:
+                raise SystemExit(f"Unknown service: {target}")
+            result[target] = cast(value)
+    return result
+
+
+def parse_mix(value):
+    weights = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in MESSAGE_KINDS:
+            raise SystemExit(f"Unknown message kind: {kind}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def build_behaviors(args):
+    latency = parse_service_values(args.latency)
+    error_rate = parse_service_values(args.error_rate)
+    rate_limit = parse_service_values(args.rate_limit)
+    return {
+        service: UpstreamBehavior(
+            latency=latency.get(service, 0.0),
+            jitter=args.jitter,
+            error_rate=error_rate.get(service, 0.0),
+            rate_limit_rate=rate_limit.get(service, 0.0),
+            retry_after=args.retry_after,
+        )
+        for service in SERVICES
+    }
+
+
+def prepare_environment(upstream_url, workdir):
+    """寫入指向替身伺服器的 .env 與假的 Google 權杖，並切換到暫存目錄 (快取、outbox 皆寫在此)"""
+    token_path = os.path.join(workdir, 'token.json')
+    with open(token_path, 'w') as f:
+        json.dump({
+            "token": "bench-token",
+            "refresh_token": "bench-refresh",
+            "client_id": "bench",
+            "client_secret": "bench",
+            "token_uri": f"{upstream_url}/token",
+            # 沒有 expiry 時 google-auth 視為已過期，會向真正的 Google 更新權杖
+            "expiry": "2099-01-01T00:00:00Z",
+        }, f)
+
+    settings = {
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-access-token",
+        "LINE_API_HOST": upstream_url,
+        "LINE_DATA_API_HOST": upstream_url,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"{upstream_url}/v1",
+        "NOTION_API_KEY": "secret_bench",
+        "NOTION_DATABASE_ID": "bench-database",
+        "NOTION_BASE_URL": upstream_url,
+        "NOTION_OUTBOX_RETRY_SECONDS": "3600",
+        "APIFY_API_KEY": "apify_api_bench",
+        "APIFY_API_URL": upstream_url,
+        "GOOGLE_TOKEN_PATH": token_path,
+        "GOOGLE_DRIVE_ROOT_URL": upstream_url,
+        "ALLOWED_LINE_ID": "",
+        "DATA_DIR": os.path.join(workdir, 'data'),
+    }
+    env_path = os.path.join(workdir, 'bench.env')
+    with open(env_path, 'w') as f:
+        for key, value in settings.items():
+            f.write(f"{key}={value}\n")
+    os.environ["DOTENV_PATH"] = env_path
+    os.chdir(workdir)
+
+
+def build_event(kind, index, upstream_url):
+    """產生單一 LINE MessageEvent (每筆皆有唯一的 webhookEventId 與 message id，避免被去重或命中快取)"""
+    message_id = f"{int(time.time() * 1000)}{index:06d}"
+    if kind == "text":
+        message = {"type": "text", "id": message_id, "quoteToken": "q", "text": f"你好 {index}"}
+    elif kind == "summary":
+        message = {"type": "text", "id": message_id, "quoteToken": "q",
+                   "text": f"/a 第 {index} 則靈感：每天花十分鐘整理筆記，一週後回顧並挑出值得延伸的主題。"}
+    elif kind == "url":
+        message = {"type": "text", "id": message_id, "quoteToken": "q",
+                   "text": f"看看這篇 {upstream_url}/article/{index}-{uuid.uuid4().hex[:8]}"}
+    elif kind == "audio":
+        message = {"type": "audio", "id": message_id, "duration": 30000,
+                   "contentProvider": {"type": "line"}}
+    else:
+        message = {"type": "image", "id": message_id, "quoteToken": "q",
+                   "contentProvider": {"type": "line"}}
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": USER_ID},
+        "webhookEventId": uuid.uuid4().hex.upper(),
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "message": message,
+    }
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def histogram_percentile(buckets, counts, total, q):
+    """由累積 bucket 計數以線性內插估算百分位數"""
+    if total == 0:
+        return 0.0
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0
+    for bound, count in zip(buckets, counts):
+        if count >= rank:
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return float('inf')
+
+
+def stage_report(histogram):
+    """依 stage 彙總各 note_type / outcome 的 bucket 後計算 p50/p95/p99"""
+    per_stage = {}
+    for key, series in histogram.snapshot().items():
+        labels = dict(key)
+        stage = per_stage.setdefault(labels["stage"], {"counts": [0] * len(histogram.buckets), "count": 0, "sum": 0.0, "errors": 0})
+        stage["counts"] = [a + b for a, b in zip(stage["counts"], series["counts"])]
+        stage["count"] += series["count"]
+        stage["sum"] += series["sum"]
+        if labels.get("outcome") == "error":
+            stage["errors"] += series["count"]
+    rows = []
+    for stage, data in sorted(per_stage.items()):
+        rows.append({
+            "stage": stage,
+            "count": data["count"],
+            "errors": data["errors"],
+            "mean": data["sum"] / data["count"] if data["count"] else 0.0,
+            "p50": histogram_percentile(histogram.buckets, data["counts"], data["count"], 0.50),
+            "p95": histogram_percentile(histogram.buckets, data["counts"], data["count"], 0.95),
+            "p99": histogram_percentile(histogram.buckets, data["counts"], data["count"], 0.99),
+        })
+    return rows
+
+
+def max_rss_kb():
+    # Linux 上 ru_maxrss 單位為 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def run(bot, args, upstream_url):
+    weights = parse_mix(args.mix)
+    kinds = random.choices(list(weights), weights=list(weights.values()), k=args.requests)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    ack_latencies = []
+    statuses = {}
+
+    async with bot.app.router.lifespan_context(bot.app):
+        transport = httpx.ASGITransport(app=bot.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            async def send(index, kind):
+                body = json.dumps({
+                    "destination": "Ubench",
+                    "events": [build_event(kind, index, upstream_url)],
+                }).encode('utf-8')
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await http.post(
+                        "/callback", content=body,
+                        headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"}
+                    )
+                    ack_latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            if args.trace_memory:
+                tracemalloc.start()
+            rss_before = max_rss_kb()
+            started = time.perf_counter()
+            await asyncio.gather(*(send(i, kind) for i, kind in enumerate(kinds)))
+            ack_elapsed = time.perf_counter() - started
+            await bot.job_queue.join()
+            total_elapsed = time.perf_counter() - started
+            rss_after = max_rss_kb()
+            traced_peak = None
+            if args.trace_memory:
+                _, traced_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+        queue_stats = bot.job_queue.stats()
+
+    ack_latencies.sort()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mix": {kind: kinds.count(kind) for kind in weights},
+        "statuses": statuses,
+        "ack": {
+            "elapsed_seconds": ack_elapsed,
+            "requests_per_second": args.requests / ack_elapsed if ack_elapsed else 0.0,
+            "p50_ms": percentile(ack_latencies, 0.50) * 1000,
+            "p95_ms": percentile(ack_latencies, 0.95) * 1000,
+            "p99_ms": percentile(ack_latencies, 0.99) * 1000,
+        },
+        "end_to_end": {
+            "elapsed_seconds": total_elapsed,
+            "jobs_per_second": queue_stats["completed"] / total_elapsed if total_elapsed else 0.0,
+            "completed": queue_stats["completed"],
+            "failed": queue_stats["failed"],
+            "rejected": queue_stats["rejected"],
+            "queue_wait_avg_ms": queue_stats["wait_seconds_avg"] * 1000,
+            "run_avg_ms": queue_stats["run_seconds_avg"] * 1000,
+        },
+        "memory": {
+            "peak_rss_mb": rss_after / 1024,
+            "rss_growth_kb_per_request": (rss_after - rss_before) / args.requests,
+            "traced_peak_kb_per_request": traced_peak / 1024 / args.requests if traced_peak is not None else None,
+        },
+        "stages": stage_report(stage_duration),
+    }
+
+
+def print_report(report, upstream_counts):
+    ack = report["ack"]
+    e2e = report["end_to_end"]
+    memory = report["memory"]
+    print(f"\nRequests: {report['requests']}  concurrency: {report['concurrency']}  mix: {report['mix']}")
+    print(f"HTTP status: {report['statuses']}")
+    print(f"Webhook ack: {ack['requests_per_second']:.1f} req/s  "
+          f"p50 {ack['p50_ms']:.1f} ms  p95 {ack['p95_ms']:.1f} ms  p99 {ack['p99_ms']:.1f} ms")
+    print(f"End-to-end:  {e2e['jobs_per_second']:.1f} jobs/s  completed {e2e['completed']}  failed {e2e['failed']}  "
+          f"rejected {e2e['rejected']}  queue wait avg {e2e['queue_wait_avg_ms']:.1f} ms  run avg {e2e['run_avg_ms']:.1f} ms")
+    line = f"Memory:      peak RSS {memory['peak_rss_mb']:.1f} MB  RSS growth {memory['rss_growth_kb_per_request']:.1f} KB/req"
+    if memory["traced_peak_kb_per_request"] is not None:
+        line += f"  traced peak {memory['traced_peak_kb_per_request']:.1f} KB/req"
+    print(line)
+    print(f"Upstream calls: {upstream_counts}")
+    print(f"\n{'stage':<20}{'count':>8}{'errors':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in report["stages"]:
+        print(f"{row['stage']:<20}{row['count']:>8}{row['errors']:>8}{row['mean'] * 1000:>10.1f}"
+              f"{row['p50'] * 1000:>10.1f}{row['p95'] * 1000:>10.1f}{row['p99'] * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE 靈感助手離線效能測試")
+    parser.add_argument("--requests", type=int, default=200, help="送出的 webhook 數量")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時送出的 webhook 數量")
+    parser.add_argument("--mix", default="text=1,summary=2,url=2,audio=1,image=1",
+                        help="訊息類型權重 (text, summary, url, audio, image)")
+    parser.add_argument("--latency", action="append", metavar="SERVICE=SECONDS",
+                        help=f"替身服務的平均延遲，服務：{', '.join(SERVICES)}, all")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=RATIO", help="回傳 500 的比例")
+    parser.add_argument("--rate-limit", action="append", metavar="SERVICE=RATIO", help="回傳 429 的比例")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 回應的 Retry-After 秒數")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延遲的隨機抖動比例")
+    parser.add_argument("--media-bytes", type=int, default=200_000, help="圖片/語音下載內容大小")
+    parser.add_argument("--article-paragraphs", type=int, default=8,
+                        help="替身網頁的段落數 (加大可測試長文分段摘要)")
+    parser.add_argument("--port", type=int, default=8765, help="替身伺服器埠號")
+    parser.add_argument("--seed", type=int, default=None, help="亂數種子")
+    parser.add_argument("--trace-memory", action="store_true", help="以 tracemalloc 追蹤配置量 (會降低吞吐量)")
+    parser.add_argument("--json", dest="json_path", help="另將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = FakeUpstreamServer(
+        build_behaviors(args), port=args.port, media_bytes=args.media_bytes,
+        article_paragraphs=args.article_paragraphs
+    ).start()
+    workdir = tempfile.mkdtemp(prefix="linebot-bench-")
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    try:
+        prepare_environment(server.base_url, workdir)
+        import app as bot  # 需在設定環境變數後才匯入
+
+        report = asyncio.run(run(bot, args, server.base_url))
+        print_report(report, dict(server.app.state.request_counts))
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
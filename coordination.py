@@ -0,0 +1,209 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from lazy import optional
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class SQLiteCoordinator:
+    """以 SQLite 檔案在同一台機器的多個 worker 程序間共用狀態 (鍵值、限流權杖桶、鎖)
+
+    所有方法都是阻塞呼叫 (最多等待 30 秒寫入鎖)，在事件迴圈中請以 asyncio.to_thread 呼叫。
+    """
+
+    def __init__(self, path, purge_interval=300):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # timeout：其他程序持有寫入鎖時最多等待的秒數
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+        self._lock = threading.Lock()
+        # 寫入時順便清除過期的鍵 (擷取內容等大型值)，最多每 purge_interval 秒一次
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE 先取得寫入鎖，避免讀取後被其他程序搶先寫入
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, ?)', (key, value, expires_at))
+        if now - self._purged_at > self.purge_interval:
+            self.purge()
+
+    def add(self, key, value, ttl=None):
+        """鍵不存在 (或已過期) 時寫入並回傳 True，否則回傳 False"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM kv WHERE key = ? AND expires_at < ?', (key, now))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO kv VALUES (?, ?, ?)', (key, value, now + ttl if ttl else None)
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key, value=None):
+        """刪除鍵；指定 value 時只有內容相符才刪除 (用於釋放自己持有的鎖)"""
+        with self._lock:
+            if value is None:
+                self._conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+            else:
+                self._conn.execute('DELETE FROM kv WHERE key = ? AND value = ?', (key, value))
+
+    def take_tokens(self, name, rate, capacity, tokens=1):
+        """從共用權杖桶取出 tokens 個權杖；成功回傳 0，否則回傳需等待的秒數"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE name = ?', (name,)).fetchone()
+            available = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / rate
+            conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (name, available, now))
+            return wait
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('DELETE FROM kv WHERE expires_at < ?', (now,))
+            self._purged_at = now
+
+
+# 以伺服器時間計算，避免多台機器時鐘不一致
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(data[1]) or capacity
+local updated_at = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisCoordinator:
+    """以 Redis (或相容服務) 在多個程序與多台機器間共用狀態 (同步用戶端，在事件迴圈中請以 asyncio.to_thread 呼叫)"""
+
+    def __init__(self, url, prefix='linebot:'):
+        # redis 為選用套件，只有使用 redis:// 協調後端時才匯入
+        redis = optional('redis')
+        if redis is None:
+            raise RuntimeError("使用 Redis 協調後端需要安裝 redis 套件")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._take_tokens = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+
+    def get(self, key):
+        return self._redis.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self._redis.set(self.prefix + key, value, ex=int(ttl) if ttl else None, nx=True))
+
+    def delete(self, key, value=None):
+        if value is None:
+            self._redis.delete(self.prefix + key)
+        else:
+            self._release(keys=[self.prefix + key], args=[value])
+
+    def take_tokens(self, name, rate, capacity, tokens=1):
+        return float(self._take_tokens(keys=[f"{self.prefix}bucket:{name}"], args=[rate, capacity, tokens]))
+
+    def purge(self):
+        # Redis 會自行清除過期的鍵
+        pass
+
+
+@contextmanager
+def distributed_lock(coordinator, name, ttl=60, timeout=30, poll_interval=0.1):
+    """跨程序互斥鎖 (同步版本，供執行緒中的程式碼使用)；ttl 避免持有者當機後永遠鎖住"""
+    key = f"lock:{name}"
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout
+    while not coordinator.add(key, owner, ttl):
+        if time.monotonic() > deadline:
+            raise LockTimeout(f"Timed out waiting for lock {name}")
+        time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        coordinator.delete(key, owner)
+
+
+class SharedTokenBucket:
+    """跨程序共用的權杖桶限流器，介面與 notion_writer.TokenBucket 相同"""
+
+    def __init__(self, coordinator, name, rate, capacity=None):
+        self.coordinator = coordinator
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+
+    async def acquire(self):
+        while True:
+            wait = await asyncio.to_thread(self.coordinator.take_tokens, self.name, self.rate, self.capacity)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def create_coordinator(url):
+    """依網址建立協調後端：sqlite:///path/to/file.sqlite3、redis://host:6379/0；未設定時回傳 None (僅單一程序)"""
+    if not url:
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteCoordinator(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCoordinator(url)
+    raise ValueError(f"Unsupported coordination backend: {url}")
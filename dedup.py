@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def event_keys(event):
+    """取得事件的去重鍵：webhookEventId 與 message.id"""
+    keys = []
+    webhook_event_id = getattr(event, 'webhook_event_id', None)
+    if webhook_event_id:
+        keys.append(f"event:{webhook_event_id}")
+    message = getattr(event, 'message', None)
+    if message is not None and getattr(message, 'id', None):
+        keys.append(f"message:{message.id}")
+    return keys
+
+
+def is_redelivery(event):
+    delivery_context = getattr(event, 'delivery_context', None)
+    return bool(delivery_context and delivery_context.is_redelivery)
+
+
+class EventDeduplicator:
+    """LINE 事件去重：記憶體中保留有限數量的已處理鍵，可選用 SQLite 或協調後端讓重啟後或多程序間共用"""
+
+    def __init__(self, max_entries=10000, ttl=86400, sqlite_path=None, coordinator=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.redeliveries = 0
+        self._conn = None
+        # 協調後端 (coordination.py)：多個 worker 程序或多台機器共用已處理的鍵
+        self.coordinator = coordinator
+        if sqlite_path:
+            directory = os.path.dirname(sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS seen_events (key TEXT PRIMARY KEY, created_at REAL NOT NULL)')
+
+    def _expire(self, now):
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl and len(self._seen) <= self.max_entries:
+                break
+            self._seen.popitem(last=False)
+
+    def _claim_sqlite(self, keys, now):
+        self._conn.execute('DELETE FROM seen_events WHERE created_at < ?', (now - self.ttl,))
+        claimed = False
+        for key in keys:
+            cursor = self._conn.execute('INSERT OR IGNORE INTO seen_events VALUES (?, ?)', (key, now))
+            claimed = claimed or cursor.rowcount == 0
+        return claimed
+
+    def claim(self, event):
+        """第一次看到此事件時回傳 True；重複投遞或處理中的重複事件回傳 False"""
+        keys = event_keys(event)
+        now = time.time()
+        with self._lock:
+            self.checked += 1
+            if is_redelivery(event):
+                self.redeliveries += 1
+            if not keys:
+                return True
+            self._expire(now)
+            duplicate = any(key in self._seen for key in keys)
+            if self._conn is not None:
+                # SQLite 層：INSERT OR IGNORE 失敗代表其他程序或重啟前已處理過
+                duplicate = self._claim_sqlite(keys, now) or duplicate
+            if self.coordinator is not None:
+                # 每個鍵都要嘗試寫入，其他程序才看得到完整的鍵
+                claimed = [self.coordinator.add(f"dedup:{key}", "1", self.ttl) for key in keys]
+                duplicate = not all(claimed) or duplicate
+            for key in keys:
+                self._seen[key] = now
+                self._seen.move_to_end(key)
+            if duplicate:
+                self.duplicates += 1
+                return False
+            return True
+
+    def release(self, event):
+        """撤銷 claim (例如佇列已滿回傳 503)，讓 LINE 重新投遞的同一事件能再次被接受"""
+        keys = event_keys(event)
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+                if self._conn is not None:
+                    self._conn.execute('DELETE FROM seen_events WHERE key = ?', (key,))
+                if self.coordinator is not None:
+                    self.coordinator.delete(f"dedup:{key}")
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "redeliveries": self.redeliveries,
+            "hit_rate": self.duplicates / self.checked if self.checked else 0.0,
+            "entries": len(self._seen),
+        }
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from coordination import distributed_lock
+from lazy import load
+
+# 協調後端中儲存最新權杖的鍵
+SHARED_TOKEN_KEY = 'google:token'
+
+
+def _credentials_class():
+    # google-auth 與 googleapiclient 匯入較慢，第一次使用 Drive 時才載入
+    return load('google.oauth2.credentials').Credentials
+
+
+def _refresh(creds):
+    creds.refresh(load('google.auth.transport.requests').Request())
+
+
+class DriveClientManager:
+    """全程序共用的 Google Drive 用戶端：憑證常駐記憶體、提前更新權杖、離線載入 discovery 文件"""
+
+    def __init__(self, scopes, token_path='token.json', client_secrets_path='credentials.json',
+                 discovery_path=None, refresh_margin=300, root_url=None, coordinator=None):
+        self.scopes = scopes
+        self.token_path = token_path
+        self.client_secrets_path = client_secrets_path
+        self.discovery_path = discovery_path
+        # 指定時改寫 discovery 文件的 rootUrl (例如指向本地測試替身)
+        self.root_url = root_url
+        # 協調後端 (coordination.py)：多個 worker 共用已更新的權杖，同一時間只由一個程序更新
+        self.coordinator = coordinator
+        # 權杖剩餘有效秒數低於此值時就先行更新
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._creds = None
+        self._discovery = None
+        self._lock = threading.Lock()
+        # httplib2 不是執行緒安全的，每個執行緒各自持有一個 service (共用同一份憑證)
+        self._local = threading.local()
+
+    def _load_discovery(self):
+        """讀取 Drive v3 discovery 文件 (優先使用指定檔案，否則用套件內建的靜態文件)"""
+        if self._discovery is None:
+            if self.discovery_path:
+                with open(self.discovery_path, encoding='utf-8') as f:
+                    self._discovery = json.load(f)
+            else:
+                self._discovery = json.loads(load('googleapiclient.discovery_cache').get_static_doc('drive', 'v3'))
+            if self.root_url:
+                root_url = self.root_url.rstrip('/') + '/'
+                self._discovery['rootUrl'] = root_url
+                self._discovery['baseUrl'] = root_url + self._discovery['servicePath']
+        return self._discovery
+
+    def _needs_refresh(self, creds):
+        if not creds.valid:
+            return True
+        if creds.expiry is None:
+            return False
+        # google-auth 的 expiry 為不含時區的 UTC 時間
+        return creds.expiry - datetime.utcnow() < self.refresh_margin
+
+    def _save_token(self, creds):
+        # 先寫入暫存檔再替換，避免並行寫入造成 token.json 損毀
+        tmp_path = f"{self.token_path}.tmp"
+        with open(tmp_path, 'w') as token:
+            token.write(creds.to_json())
+        os.replace(tmp_path, self.token_path)
+
+    def _load_shared(self):
+        """讀取其他程序更新後寫入協調後端的權杖"""
+        if self.coordinator is None:
+            return None
+        token_json = self.coordinator.get(SHARED_TOKEN_KEY)
+        if not token_json:
+            return None
+        return _credentials_class().from_authorized_user_info(json.loads(token_json), self.scopes)
+
+    def _refresh_shared(self, creds):
+        """持有跨程序鎖時更新權杖，避免多個 worker 同時以同一個 refresh token 更新"""
+        with distributed_lock(self.coordinator, 'google-token-refresh'):
+            shared = self._load_shared()
+            if shared is not None and not self._needs_refresh(shared):
+                return shared
+            _refresh(creds)
+            self.coordinator.set(SHARED_TOKEN_KEY, creds.to_json())
+            return creds
+
+    def get_credentials(self):
+        """取得有效憑證，必要時更新權杖或執行登入流程"""
+        creds = self._creds
+        if creds is not None and not self._needs_refresh(creds):
+            return creds
+        with self._lock:
+            # 取得鎖之後再檢查一次，其他執行緒可能已完成更新
+            creds = self._creds
+            if creds is None or self._needs_refresh(creds):
+                # 其他 worker 可能已更新過權杖
+                creds = self._load_shared() or creds
+            if creds is None and os.path.exists(self.token_path):
+                creds = _credentials_class().from_authorized_user_file(self.token_path, self.scopes)
+            if creds is not None and not self._needs_refresh(creds):
+                self._creds = creds
+                return creds
+            if creds and creds.refresh_token:
+                if self.coordinator is not None:
+                    creds = self._refresh_shared(creds)
+                else:
+                    _refresh(creds)
+            else:
+                flow = load('google_auth_oauthlib.flow').InstalledAppFlow.from_client_secrets_file(
+                    self.client_secrets_path, self.scopes)
+                creds = flow.run_local_server(port=0)
+                if self.coordinator is not None:
+                    self.coordinator.set(SHARED_TOKEN_KEY, creds.to_json())
+            # 儲存憑證供下次使用
+            self._save_token(creds)
+            self._creds = creds
+            return creds
+
+    def preload(self):
+        """預先匯入 Google 套件並讀取 discovery 文件 (不觸發登入流程)，供啟動後的背景預熱使用"""
+        _credentials_class()
+        load('googleapiclient.discovery')
+        load('googleapiclient.http')
+        self._load_discovery()
+
+    def get_service(self):
+        """取得目前執行緒的 Drive service，首次使用時才建立"""
+        creds = self.get_credentials()
+        service = getattr(self._local, 'service', None)
+        if service is None or getattr(self._local, 'creds', None) is not creds:
+            service = load('googleapiclient.discovery').build_from_document(self._load_discovery(), credentials=creds)
+            self._local.service = service
+            self._local.creds = creds
+        return service
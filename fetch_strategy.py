@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+from resilience import CircuitOpenError
+
+
+class FetchStrategyEngine:
+    """一般網頁的擷取策略：先跑本地 trafilatura，必要時 (或超過對沖延遲後) 才升級到 Apify，取先完成的合格結果"""
+
+    def __init__(self, hedge_delay=4.0, min_chars=200, stats_path=None, min_samples=3, remote_first_ratio=0.3):
+        self.hedge_delay = hedge_delay
+        # 內容少於此字數視為品質不足 (例如只抓到 JS 網頁的外殼)
+        self.min_chars = min_chars
+        self.stats_path = stats_path
+        # 本地策略樣本數達到 min_samples 且成功率低於 remote_first_ratio 時，直接使用 Apify
+        self.min_samples = min_samples
+        self.remote_first_ratio = remote_first_ratio
+        self._lock = threading.Lock()
+        self.domain_stats = self._load_stats()
+        # 統計只在記憶體中累加，由 run_flush_loop 定期寫回檔案
+        self._dirty = False
+
+    def _load_stats(self):
+        if self.stats_path and os.path.exists(self.stats_path):
+            try:
+                with open(self.stats_path, encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading fetch strategy stats: {e}")
+        return {}
+
+    def flush(self):
+        """將有變動的統計寫回檔案 (阻塞 I/O，在事件迴圈中請以 asyncio.to_thread 呼叫)"""
+        if not self.stats_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self.domain_stats)
+            self._dirty = False
+        directory = os.path.dirname(self.stats_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.stats_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.stats_path)
+
+    async def run_flush_loop(self, interval):
+        """定期寫回統計，於 FastAPI 啟動時建立背景工作"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"Error saving fetch strategy stats: {e}")
+
+    def is_acceptable(self, content):
+        return bool(content) and len(content.strip()) >= self.min_chars
+
+    def _record(self, host, strategy, ok):
+        with self._lock:
+            stats = self.domain_stats.setdefault(host, {"local_ok": 0, "local_fail": 0, "remote_ok": 0, "remote_fail": 0})
+            stats[f"{strategy}_{'ok' if ok else 'fail'}"] += 1
+            self._dirty = True
+
+    def prefers_remote(self, host):
+        """依過去紀錄判斷此網域是否需要 JS 渲染 (本地擷取經常失敗)"""
+        stats = self.domain_stats.get(host)
+        if not stats:
+            return False
+        samples = stats["local_ok"] + stats["local_fail"]
+        return samples >= self.min_samples and stats["local_ok"] / samples < self.remote_first_ratio
+
+    async def fetch(self, url, local, remote):
+        """local / remote 為回傳 coroutine 的函式，回傳最先取得的合格內容"""
+        host = (urlsplit(url).hostname or '').lower()
+        strategies = {"local": local, "remote": remote}
+        order = ["remote", "local"] if self.prefers_remote(host) else ["local", "remote"]
+
+        async def attempt(strategy):
+            try:
+                content = await strategies[strategy]()
+            except CircuitOpenError:
+                # 服務暫時停用 (斷路器開啟) 不代表此網域不適合該策略，不列入統計
+                return None
+            except Exception as e:
+                print(f"Error fetching {url} with {strategy} strategy: {e}")
+                content = None
+            self._record(host, strategy, self.is_acceptable(content))
+            return content
+
+        tasks = {asyncio.create_task(attempt(order[0])): order[0]}
+        best = None
+        try:
+            # 首選策略在對沖延遲內完成就不必啟動第二個
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            for task in done:
+                content = task.result()
+                if self.is_acceptable(content):
+                    return content
+                best = content or best
+                del tasks[task]
+            tasks[asyncio.create_task(attempt(order[1]))] = order[1]
+
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    content = task.result()
+                    del tasks[task]
+                    if self.is_acceptable(content):
+                        return content
+                    if content and (not best or len(content) > len(best)):
+                        best = content
+            # 兩者都不合格時，回傳較長的非空結果
+            return best
+        finally:
+            # 取消落後的策略 (已送出的 Apify run 會在平台端自行結束)
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,87 @@
+import io
+
+from lazy import load, optional
+
+# OpenAI Vision 高解析度模式會先縮到 2048x2048 內，再把短邊縮到 768；超過的像素只會浪費頻寬
+VISION_MAX_SIDE = 2048
+VISION_SHORT_SIDE = 768
+# 長邊不超過此值時 low 模式 (固定 85 tokens) 已能看清全圖
+LOW_DETAIL_SIDE = 512
+
+
+def sniff_image_format(data):
+    """依檔頭判斷圖片格式，回傳 (mimetype, 副檔名)"""
+    head = bytes(data[:16])
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg', 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png', 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif', 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'image/heic', 'heic'
+    # 無法辨識時沿用 LINE 最常見的 JPEG
+    return 'image/jpeg', 'jpg'
+
+
+def _read_all(data):
+    # data 可以是 bytes 或可讀取的檔案物件
+    if hasattr(data, 'read'):
+        data.seek(0)
+        return data.read()
+    return data
+
+
+def _target_size(width, height, max_side, short_side):
+    scale = min(1.0, max_side / max(width, height), short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_vision_image(data, detail='auto', max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE, quality=85):
+    """產生送給 Vision 的縮圖版本，回傳 (bytes, mimetype, detail)；原始 bytes 不會被修改或複製
+
+    data 可以是 bytes 或檔案物件 (例如暫存在磁碟的大圖，Pillow 會直接從檔案解碼)。
+    detail 為 auto 時，小圖使用 low、其餘使用 high。Pillow 未安裝或無法解碼時回傳原圖。
+    """
+    if hasattr(data, 'read'):
+        source = data
+        head = data.read(16)
+        data.seek(0)
+    else:
+        # BytesIO 包裝 bytes 時不會複製內容
+        source = io.BytesIO(data)
+        head = data[:16]
+    mimetype, _ = sniff_image_format(head)
+    # Pillow 為選用套件，第一次縮圖時才匯入；未安裝時 Vision 直接使用原始圖片
+    Image = optional('PIL.Image')
+    if Image is None:
+        return _read_all(data), mimetype, detail
+    ImageOps = load('PIL.ImageOps')
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            target = _target_size(width, height, max_side, short_side)
+            if detail == 'auto':
+                detail = 'low' if max(target) <= LOW_DETAIL_SIDE else 'high'
+            if target == (width, height) and mimetype in ('image/jpeg', 'image/png', 'image/webp', 'image/gif'):
+                # 不需縮小且 Vision 支援此格式，直接使用原圖
+                return _read_all(data), mimetype, detail
+            # JPEG 可在解碼時直接以 1/2、1/4、1/8 比例縮小，省下完整解碼的時間與記憶體
+            image.draft('RGB', target)
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                # 透明背景以白底合成後再存成 JPEG
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+                image = background
+            target = _target_size(image.width, image.height, max_side, short_side)
+            if image.size != target:
+                image = image.resize(target, Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+            return output.getvalue(), 'image/jpeg', detail
+    except Exception as e:
+        print(f"Error preparing image for Vision, using original: {e}")
+        return _read_all(data), mimetype, detail
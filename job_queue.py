@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+
+class JobQueue:
+    """程序內的背景工作佇列，由固定數量的 worker 依序處理 LINE 事件"""
+
+    def __init__(self, worker_count=4, maxsize=100):
+        self.worker_count = max(1, worker_count)
+        self.maxsize = maxsize
+        self._queue = None
+        self._workers = []
+        # 佇列指標 (累計數量與延遲)
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_progress = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    async def start(self):
+        """建立佇列並啟動 worker (需在事件迴圈中呼叫)"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"job-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+
+    async def stop(self):
+        """停止所有 worker，尚未處理的工作會被捨棄"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, func, *args):
+        """將工作放入佇列，佇列已滿時拋出 asyncio.QueueFull"""
+        if self._queue is None:
+            raise RuntimeError("JobQueue 尚未啟動")
+        try:
+            self._queue.put_nowait((func, args, time.monotonic()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        self.enqueued += 1
+
+    async def put(self, func, *args):
+        """將工作放入佇列，佇列已滿時等待空位 (用於重啟後補回未完成的工作)"""
+        if self._queue is None:
+            raise RuntimeError("JobQueue 尚未啟動")
+        await self._queue.put((func, args, time.monotonic()))
+        self.enqueued += 1
+
+    async def join(self):
+        """等待佇列中的工作全部完成"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _worker(self, index):
+        while True:
+            func, args, enqueued_at = await self._queue.get()
+            started_at = time.monotonic()
+            wait = started_at - enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self.in_progress += 1
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await func(*args)
+                else:
+                    # 同步的處理函式丟到執行緒池，避免阻塞事件迴圈
+                    await asyncio.to_thread(func, *args)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Error processing job in worker {index}: {e}")
+            finally:
+                elapsed = time.monotonic() - started_at
+                self._run_total += elapsed
+                self._run_max = max(self._run_max, elapsed)
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    def stats(self):
+        """回傳佇列深度與延遲指標"""
+        finished = self.completed + self.failed
+        started = finished + self.in_progress
+        return {
+            "workers": self.worker_count,
+            "depth": self._queue.qsize() if self._queue else 0,
+            "maxsize": self.maxsize,
+            "in_progress": self.in_progress,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_seconds_avg": self._wait_total / started if started else 0.0,
+            "wait_seconds_max": self._wait_max,
+            "run_seconds_avg": self._run_total / finished if finished else 0.0,
+            "run_seconds_max": self._run_max,
+        }
@@ -0,0 +1,133 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# 目前處理中的工作 id，讓各處理函式記錄階段結果時不必層層傳遞
+current_job_id = contextvars.ContextVar('current_job_id', default=None)
+
+
+class JobStore:
+    """持久化的事件工作紀錄 (SQLite WAL)：保存每個事件已完成的階段與中間結果，重啟後從中斷處繼續"""
+
+    def __init__(self, path, max_attempts=3):
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'job_id TEXT PRIMARY KEY, event TEXT NOT NULL, status TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, '
+            'created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS job_stages ('
+            'job_id TEXT NOT NULL, stage TEXT NOT NULL, result TEXT NOT NULL, completed_at REAL NOT NULL, '
+            'PRIMARY KEY (job_id, stage))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at)')
+        self._lock = threading.Lock()
+
+    def add(self, job_id, event_json):
+        """記錄新工作；已存在 (例如重新投遞) 時回傳 False"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO jobs (job_id, event, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, event_json, PENDING, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def discard(self, job_id):
+        """移除尚未開始的工作 (例如佇列已滿、交由 LINE 重新投遞)"""
+        with self._lock:
+            self._conn.execute('DELETE FROM job_stages WHERE job_id = ?', (job_id,))
+            self._conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def start(self, job_id):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET attempts = attempts + 1, updated_at = ? WHERE job_id = ?', (time.time(), job_id)
+            )
+
+    def get_stage(self, job_id, stage):
+        """回傳 (是否已完成, 結果)"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result FROM job_stages WHERE job_id = ? AND stage = ?', (job_id, stage)
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def save_stage(self, job_id, stage, result):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO job_stages (job_id, stage, result, completed_at) VALUES (?, ?, ?, ?)',
+                (job_id, stage, json.dumps(result, ensure_ascii=False), now)
+            )
+            self._conn.execute('UPDATE jobs SET updated_at = ? WHERE job_id = ?', (now, job_id))
+
+    async def run_stage(self, stage, func):
+        """執行一個處理階段：先前已完成則直接回傳紀錄中的結果，否則執行並保存 (結果為空時不保存，下次會重試)"""
+        job_id = current_job_id.get()
+        if job_id is not None:
+            found, result = self.get_stage(job_id, stage)
+            if found:
+                print(f"Resuming job {job_id}: reusing {stage} result")
+                return result
+        result = await func()
+        if job_id is not None and result:
+            self.save_stage(job_id, stage, result)
+        return result
+
+    def complete(self, job_id):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, last_error = NULL, updated_at = ? WHERE job_id = ?',
+                (DONE, time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, last_error = ?, updated_at = ? WHERE job_id = ?',
+                (FAILED, str(error), time.time(), job_id)
+            )
+
+    def unfinished(self, before):
+        """回傳 before 之前建立、需要繼續處理的工作 [(job_id, event_json)]，依建立時間排序；超過嘗試上限者略過"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT job_id, event FROM jobs WHERE status IN (?, ?) AND attempts < ? AND created_at < ? ORDER BY created_at',
+                (PENDING, FAILED, self.max_attempts, before)
+            ).fetchall()
+
+    def purge(self, retention):
+        """刪除完成超過 retention 秒的工作紀錄"""
+        cutoff = time.time() - retention
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM job_stages WHERE job_id IN (SELECT job_id FROM jobs WHERE status = ? AND updated_at < ?)',
+                (DONE, cutoff)
+            )
+            cursor = self._conn.execute('DELETE FROM jobs WHERE status = ? AND updated_at < ?', (DONE, cutoff))
+            return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
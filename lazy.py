@@ -0,0 +1,83 @@
+import asyncio
+import importlib
+import sys
+import threading
+import time
+
+# 各模組第一次匯入的耗時 (秒)，啟動時與 /metrics 中列出
+import_timings = {}
+_timings_lock = threading.Lock()
+# optional() 已確認未安裝的選用套件
+_missing = set()
+
+
+def record_import(name, seconds):
+    with _timings_lock:
+        if name in import_timings:
+            return
+        import_timings[name] = seconds
+    print(f"Imported {name} in {seconds * 1000:.0f} ms")
+
+
+def load(module_name):
+    """匯入模組並記錄第一次匯入的耗時
+
+    一律經過 importlib.import_module (持有該模組的匯入鎖)：其他執行緒正在匯入時會等待完成，
+    不會拿到初始化到一半的模組。
+    """
+    loaded = module_name in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if not loaded:
+        record_import(module_name, time.perf_counter() - started)
+    return module
+
+
+def optional(module_name):
+    """同 load()，但選用套件未安裝時回傳 None (只嘗試一次，之後直接回傳 None)"""
+    if module_name in _missing:
+        return None
+    try:
+        return load(module_name)
+    except ImportError:
+        _missing.add(module_name)
+        return None
+
+
+class LazyClient:
+    """第一次存取屬性時才匯入套件並建立用戶端的代理，其餘屬性與方法都轉交給實際的用戶端
+
+    第一次建立會在呼叫端的執行緒中匯入套件；在事件迴圈中第一次使用前請先 await resolve()，
+    匯入改在執行緒中進行。若不想讓第一個事件等待，可在啟動後以 warm_up() 預先建立。
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._client is not None
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+async def resolve(client):
+    """LazyClient 尚未建立時在執行緒中匯入套件並建立，避免阻塞事件迴圈；回傳 client 本身 (其他物件原樣回傳)"""
+    if isinstance(client, LazyClient) and not client.loaded:
+        await asyncio.to_thread(client.get)
+    return client
+
+
+def format_timings():
+    return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in import_timings.items())
@@ -0,0 +1,76 @@
+import asyncio
+
+import aiohttp
+from linebot.v3.messaging import (
+    AsyncApiClient,
+    AsyncMessagingApi
+)
+from linebot.v3.messaging.exceptions import ApiException
+
+
+class LineClient:
+    """共用且長期存在的 LINE Messaging API 用戶端 (連線池、keep-alive、限制並行數)"""
+
+    def __init__(self, configuration, pool_size=20, max_concurrency=10,
+                 data_host='https://api-data.line.me', content_timeout=60):
+        # aiohttp 連線池大小由 Configuration 決定，連線預設保持 keep-alive
+        configuration.connection_pool_maxsize = pool_size
+        self.configuration = configuration
+        self.pool_size = pool_size
+        # SDK 的 MessagingApiBlob 將 api-data 主機寫死，內容下載改用自己的連線池以便設定主機
+        self.data_host = data_host.rstrip('/')
+        self.content_timeout = content_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._api_client = None
+        self._messaging_api = None
+        self._data_session = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        """建立底層連線池 (aiohttp session 需在事件迴圈中建立)"""
+        async with self._start_lock:
+            if self._api_client is None:
+                self._api_client = AsyncApiClient(self.configuration)
+                self._messaging_api = AsyncMessagingApi(self._api_client)
+                self._data_session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.pool_size),
+                    headers={'Authorization': f'Bearer {self.configuration.access_token}'},
+                    timeout=aiohttp.ClientTimeout(total=self.content_timeout)
+                )
+
+    async def close(self):
+        """關閉連線池，於 FastAPI 關閉時呼叫"""
+        async with self._start_lock:
+            if self._api_client is not None:
+                await self._api_client.close()
+                await self._data_session.close()
+                self._api_client = None
+                self._messaging_api = None
+                self._data_session = None
+
+    async def _ensure_started(self):
+        if self._api_client is None:
+            await self.start()
+
+    async def reply_message(self, request):
+        await self._ensure_started()
+        async with self._semaphore:
+            return await self._messaging_api.reply_message(request)
+
+    async def push_message(self, request):
+        await self._ensure_started()
+        async with self._semaphore:
+            return await self._messaging_api.push_message(request)
+
+    async def download_message_content(self, message_id, sink, chunk_size=256 * 1024):
+        """以固定大小的區塊串流下載內容並寫入 sink (具 write())，記憶體用量不隨檔案大小增加；回傳總位元組數"""
+        await self._ensure_started()
+        size = 0
+        async with self._semaphore:
+            async with self._data_session.get(f"{self.data_host}/v2/bot/message/{message_id}/content") as response:
+                if response.status != 200:
+                    raise ApiException(status=response.status, reason=response.reason)
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    sink.write(chunk)
+                    size += len(chunk)
+        return size
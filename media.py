@@ -0,0 +1,86 @@
+import io
+import os
+import tempfile
+
+
+class MediaBuffer:
+    """以串流方式寫入的媒體內容：小於 spool_bytes 時留在記憶體，超過時改寫入暫存檔
+
+    寫入完成後可用 open() 開啟多個互相獨立的讀取器 (例如同時上傳 Drive 與交給 Vision)，
+    不需要把整個檔案複製成 bytes；用完後呼叫 close() 刪除暫存檔。
+    """
+
+    def __init__(self, spool_bytes=4 * 1024 * 1024, directory=None):
+        self.spool_bytes = spool_bytes
+        self.directory = directory
+        self.size = 0
+        self.path = None
+        self._memory = io.BytesIO()
+        self._file = None
+        self._data = None
+
+    def write(self, chunk):
+        if self._file is None and self.size + len(chunk) > self.spool_bytes:
+            # 超過門檻：把目前內容移到暫存檔，之後直接寫入磁碟
+            fd, self.path = tempfile.mkstemp(prefix='line-media-', dir=self.directory)
+            self._file = os.fdopen(fd, 'wb')
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._memory.write(chunk)
+        self.size += len(chunk)
+
+    def finish(self):
+        """寫入完成 (之後才能讀取)"""
+        if self._file is not None:
+            self._file.close()
+        elif self._memory is not None:
+            self._data = self._memory.getvalue()
+            self._memory = None
+
+    def reset(self):
+        """捨棄已寫入的內容 (下載重試前呼叫)"""
+        self.close()
+        self.size = 0
+        self._memory = io.BytesIO()
+        self._file = None
+        self._data = None
+
+    @property
+    def on_disk(self):
+        return self.path is not None
+
+    def open(self):
+        """開啟新的讀取器 (記憶體中的內容以 BytesIO 包裝，不會複製)"""
+        if self.path is not None:
+            return open(self.path, 'rb')
+        return io.BytesIO(self._data)
+
+    def head(self, size=32):
+        with self.open() as reader:
+            return reader.read(size)
+
+    def read(self):
+        """取得完整內容 (僅供必須一次送出整個檔案的 API 使用)"""
+        if self.path is None:
+            return self._data
+        with self.open() as reader:
+            return reader.read()
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,172 @@
+import contextvars
+import threading
+import time
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:  # OpenTelemetry 為選用套件
+    otel_trace = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 目前處理中的筆記類型，讓深層的階段也能帶上 note_type 標籤
+current_note_type = contextvars.ContextVar('current_note_type', default='unknown')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self):
+        """回傳各標籤組合的 bucket 計數副本 (供效能測試計算百分位數)"""
+        with self._lock:
+            return {
+                key: {"counts": list(series["counts"]), "sum": series["sum"], "count": series["count"]}
+                for key, series in self._series.items()
+            }
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class Registry:
+    """指標註冊表，輸出 Prometheus 文字格式"""
+
+    def __init__(self):
+        self._metrics = []
+        # 於輸出時才讀取數值的 gauge：name -> (說明, 回傳 {labels tuple: value} 的函式)
+        self._gauges = {}
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, collect):
+        self._gauges[name] = (help_text, collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, (help_text, collect) in self._gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Error collecting gauge {name}: {e}")
+                continue
+            for key, value in values.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+stage_duration = registry.histogram('linebot_stage_duration_seconds', '各處理階段耗時 (秒)')
+stage_total = registry.counter('linebot_stage_total', '各處理階段執行次數')
+
+_otel_enabled = False
+
+
+def enable_opentelemetry(enabled=True):
+    """啟用後每個階段同時輸出 OpenTelemetry span (需安裝 opentelemetry-api)"""
+    global _otel_enabled
+    if enabled and otel_trace is None:
+        print("OpenTelemetry is not installed, skipping span export.")
+        return
+    _otel_enabled = enabled
+
+
+class span:
+    """記錄單一處理階段的耗時與結果；可在區塊內設定 outcome (預設 success，發生例外為 error)"""
+
+    def __init__(self, stage, note_type=None):
+        self.stage = stage
+        self.note_type = note_type
+        self.outcome = 'success'
+        self._otel_span = None
+
+    def __enter__(self):
+        if self.note_type is None:
+            self.note_type = current_note_type.get()
+        if _otel_enabled:
+            self._otel_span = otel_trace.get_tracer('linebot').start_span(
+                f"stage.{self.stage}", attributes={"stage": self.stage, "note_type": self.note_type}
+            )
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started_at
+        if exc_type is not None:
+            self.outcome = 'error'
+        labels = {"stage": self.stage, "note_type": self.note_type, "outcome": self.outcome}
+        stage_duration.observe(elapsed, **labels)
+        stage_total.inc(**labels)
+        if self._otel_span is not None:
+            self._otel_span.set_attribute("outcome", self.outcome)
+            if self.outcome == 'error':
+                self._otel_span.set_status(Status(StatusCode.ERROR))
+            self._otel_span.end()
+        return False
@@ -0,0 +1,244 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+
+from lazy import optional, resolve
+
+# numpy 為選用套件，建立 NoteIndex 時才匯入；未安裝時以純 Python 逐筆計算相似度 (筆記數少時仍夠快)
+np = None
+
+# 英數字以單字為單位，中日韓文字以單字與相鄰兩字為單位
+_WORDS = re.compile(r'[a-z0-9]+|[⺀-鿿가-힯豈-﫿]+')
+_WIDE = re.compile(r'[⺀-鿿가-힯豈-﫿]')
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class HashingEmbedder:
+    """本地決定性嵌入 (特徵雜湊)：不需網路與金鑰，相同文字永遠得到相同向量，適合測試與離線使用"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        for word in _WORDS.findall(text.lower()):
+            if not _WIDE.match(word):
+                yield word
+                continue
+            yield from word
+            for i in range(len(word) - 1):
+                yield word[i:i + 2]
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            # 最低位元決定正負號，降低雜湊碰撞造成的偏差
+            vector[(value >> 1) % self.dim] += 1.0 if value & 1 else -1.0
+        return _normalize(vector)
+
+    async def embed(self, texts):
+        return [self._embed(text) for text in texts]
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings API；可共用限流器與 resilience.Upstream"""
+
+    def __init__(self, client, model='text-embedding-3-small', rate_limiter=None, upstream=None):
+        self.client = client
+        self.model = model
+        self.name = f"openai:{model}"
+        self.rate_limiter = rate_limiter
+        self.upstream = upstream
+
+    async def _create(self, texts):
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        await resolve(self.client)
+        response = await self.client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def embed(self, texts):
+        if self.upstream is not None:
+            return await self.upstream.call(self._create, texts)
+        return await self._create(texts)
+
+
+class _HyperplaneLSH:
+    """隨機超平面 LSH (cosine)：多張雜湊表，查詢時另外探測相差一個位元的鄰近桶"""
+
+    def __init__(self, dim, tables=8, bits=12, seed=7):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, dim)).astype(np.float32)
+        self.weights = 1 << np.arange(bits)
+        self.buckets = [{} for _ in range(tables)]
+
+    def _codes(self, vectors):
+        # (tables, n) 的整數桶編號
+        return ((np.einsum('tbd,nd->tnb', self.planes, vectors) > 0) @ self.weights).astype(np.int64)
+
+    def add(self, vectors, positions):
+        codes = self._codes(vectors)
+        for table, buckets in enumerate(self.buckets):
+            for code, position in zip(codes[table].tolist(), positions):
+                buckets.setdefault(code, []).append(position)
+
+    def candidates(self, vector):
+        codes = self._codes(vector[None, :])[:, 0].tolist()
+        bits = len(self.weights)
+        found = set()
+        for code, buckets in zip(codes, self.buckets):
+            found.update(buckets.get(code, ()))
+            for bit in range(bits):
+                found.update(buckets.get(code ^ (1 << bit), ()))
+        return found
+
+
+class NoteIndex:
+    """本地筆記索引：內容、摘要與中繼資料存於 SQLite，嵌入向量常駐記憶體 (numpy 矩陣) 供毫秒級相似度搜尋
+
+    筆記數超過 ann_threshold 時改用 LSH 近似最近鄰，只對候選筆記計算精確相似度；
+    多個 worker 共用同一個檔案時，搜尋前會先載入其他程序新增的筆記。
+    """
+
+    def __init__(self, path, embedder, ann_threshold=5000, max_content_chars=6000):
+        global np
+        np = optional('numpy')
+        self.embedder = embedder
+        self.ann_threshold = ann_threshold
+        self.max_content_chars = max_content_chars
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS notes ('
+            'note_id TEXT PRIMARY KEY, line_id TEXT, note_type TEXT, title TEXT, url TEXT, page_id TEXT, '
+            'summary TEXT, content TEXT, embedder TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._lock = threading.Lock()
+        self._last_rowid = 0
+        self._positions = {}
+        self._meta = []
+        self._by_line = {}
+        self._vectors = []
+        self._matrix = None
+        self._lsh = None
+        self._load_new()
+
+    def _load_new(self):
+        """載入尚未讀入記憶體的筆記 (只取目前嵌入後端產生的向量)"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT rowid, note_id, line_id, note_type, title, url, page_id, summary, created_at, vector '
+                'FROM notes WHERE rowid > ? AND embedder = ? ORDER BY rowid',
+                (self._last_rowid, self.embedder.name)
+            ).fetchall()
+            if rows:
+                self._last_rowid = rows[-1][0]
+        for row in rows:
+            meta = {
+                "note_id": row[1], "line_id": row[2], "note_type": row[3], "title": row[4],
+                "url": row[5], "page_id": row[6], "summary": row[7], "created_at": row[8],
+            }
+            self._put(meta, array('f', row[9]))
+
+    def _put(self, meta, vector):
+        position = self._positions.get(meta["note_id"])
+        if position is not None:
+            # 同一則筆記重新寫入 (例如工作重跑)：覆寫原位置，LSH 中的舊桶只會多一個候選，不影響結果
+            self._meta[position] = meta
+        else:
+            position = len(self._meta)
+            self._positions[meta["note_id"]] = position
+            self._meta.append(meta)
+            self._by_line.setdefault(meta["line_id"], []).append(position)
+        if np is None:
+            if position == len(self._vectors):
+                self._vectors.append(list(vector))
+            else:
+                self._vectors[position] = list(vector)
+            return
+        row = np.asarray(vector, dtype=np.float32)
+        if self._matrix is None:
+            self._matrix = np.zeros((64, len(row)), dtype=np.float32)
+        elif position >= len(self._matrix):
+            # 容量不足時加倍，避免每次新增都複製整個矩陣
+            grown = np.zeros((len(self._matrix) * 2, self._matrix.shape[1]), dtype=np.float32)
+            grown[:len(self._matrix)] = self._matrix
+            self._matrix = grown
+        self._matrix[position] = row
+        if self._lsh is None and len(self._meta) > self.ann_threshold:
+            self._lsh = _HyperplaneLSH(self._matrix.shape[1])
+            self._lsh.add(self._matrix[:len(self._meta)], range(len(self._meta)))
+        elif self._lsh is not None:
+            self._lsh.add(row[None, :], [position])
+
+    def _embedding_text(self, content, summary):
+        return f"{summary or ''}\n\n{(content or '')[:self.max_content_chars]}".strip()
+
+    async def add(self, note_id, content, summary, note_type, line_id=None, url=None, page_id=None, title=None):
+        """新增 (或覆寫) 一則筆記"""
+        vector = _normalize((await self.embedder.embed([self._embedding_text(content, summary)]))[0])
+        created_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (note_id, line_id, note_type, title, url, page_id, summary, content,
+                 self.embedder.name, array('f', vector).tobytes(), created_at)
+            )
+        self._load_new()
+
+    def _top(self, query, positions, k):
+        """回傳 [(相似度, 位置)]，由高到低取前 k 筆"""
+        if np is None:
+            scores = [(sum(a * b for a, b in zip(self._vectors[p], query)), p) for p in positions]
+            return sorted(scores, reverse=True)[:k]
+        positions = np.fromiter(positions, dtype=np.int64)
+        scores = self._matrix[positions] @ np.asarray(query, dtype=np.float32)
+        if len(scores) > k:
+            # 只對前 k 名排序
+            best = np.argpartition(-scores, k)[:k]
+            positions, scores = positions[best], scores[best]
+        order = np.argsort(-scores)
+        return list(zip(scores[order].tolist(), positions[order].tolist()))
+
+    async def search(self, query, k=5, line_id=None, note_type=None):
+        """回傳與 query 最相似的 k 則筆記 (可依 Line_ID 與類型過濾)，每筆含 score"""
+        self._load_new()
+        if not self._meta:
+            return []
+        vector = _normalize((await self.embedder.embed([query]))[0])
+        positions = self._by_line.get(line_id, []) if line_id is not None else range(len(self._meta))
+        if self._lsh is not None and len(positions) > self.ann_threshold:
+            candidates = self._lsh.candidates(np.asarray(vector, dtype=np.float32))
+            if line_id is not None:
+                candidates = {p for p in candidates if self._meta[p]["line_id"] == line_id}
+            # 候選太少時退回完整比對，確保有足夠結果
+            if len(candidates) >= k:
+                positions = candidates
+        if note_type is not None:
+            positions = [p for p in positions if self._meta[p]["note_type"] == note_type]
+        if not positions:
+            return []
+        ranked = self._top(vector, positions, k)
+        return [{**self._meta[position], "score": score} for score, position in ranked]
+
+    def stats(self):
+        return {
+            "notes": len(self._meta),
+            "embedder": self.embedder.name,
+            "ann": self._lsh is not None,
+            "numpy": np is not None,
+        }
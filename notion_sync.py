@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from lazy import load, resolve
+
+# pyarrow 為選用套件且匯入耗時，只有建立 NotionSync (啟用 Notion 同步) 時才以 _load_pyarrow() 匯入
+pa = pc = pq = None
+
+# 依 last_edited_time 切分時間範圍並行查詢的最小跨度 (短於此值的增量同步只用一個查詢)
+SPLIT_MIN_SECONDS = 7 * 86400
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _format_time(value):
+    return value.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _plain_text(rich_text):
+    return ''.join(part.get('plain_text') or part.get('text', {}).get('content', '') for part in rich_text or [])
+
+
+def page_to_row(page):
+    """將 Notion 頁面轉成一列資料 (欄位對應 save_to_notion 寫入的屬性)"""
+    properties = page.get('properties', {})
+    summary = _plain_text(properties.get('摘要', {}).get('rich_text'))
+    note_type = (properties.get('類型', {}).get('select') or {}).get('name')
+    note_time = (properties.get('時間', {}).get('date') or {}).get('start')
+    return {
+        "page_id": page["id"],
+        "created_time": _parse_time(page.get('created_time')),
+        "last_edited_time": _parse_time(page.get('last_edited_time')),
+        "note_time": _parse_time(note_time),
+        "title": _plain_text(properties.get('Name', {}).get('title')),
+        "note_type": note_type,
+        "summary": summary,
+        "summary_length": len(summary),
+        "url": properties.get('URL', {}).get('url'),
+        "line_id": _plain_text(properties.get('Line_ID', {}).get('rich_text')) or None,
+        "archived": bool(page.get('archived') or page.get('in_trash')),
+    }
+
+
+def _load_pyarrow():
+    global pa, pc, pq
+    if pa is None:
+        try:
+            pa_module = load('pyarrow')
+            pc = load('pyarrow.compute')
+            pq = load('pyarrow.parquet')
+            pa = pa_module
+        except ImportError:
+            raise RuntimeError("Notion 同步需要安裝 pyarrow 套件")
+
+
+def _schema():
+    return pa.schema([
+        ("page_id", pa.string()),
+        ("created_time", pa.timestamp('ms', tz='UTC')),
+        ("last_edited_time", pa.timestamp('ms', tz='UTC')),
+        ("note_time", pa.timestamp('ms', tz='UTC')),
+        ("title", pa.string()),
+        ("note_type", pa.string()),
+        ("summary", pa.string()),
+        ("summary_length", pa.int32()),
+        ("url", pa.string()),
+        ("line_id", pa.string()),
+        ("archived", pa.bool_()),
+    ])
+
+
+class NotionSync:
+    """將 Notion 筆記資料庫增量同步到本地 Parquet (append + compact)
+
+    每次同步只查詢 last_edited_time 在游標之後的頁面，新資料寫成一個 part 檔；
+    part 檔累積到 compact_after 個時，與主檔合併並只保留每個頁面的最新版本。
+    Notion 的 last_edited_time 只到分鐘，游標所在的那一分鐘會重新抓取，合併時去除重複。
+    查詢不會回傳已刪除的頁面，需要時以 full=True 重新完整同步。
+    """
+
+    def __init__(self, notion, database_id, store_dir, request=None, concurrency=3, page_size=100, compact_after=8):
+        _load_pyarrow()
+        self.notion = notion
+        self.database_id = database_id
+        self.store_dir = store_dir
+        # 共用 NotionWriter.request 的限流與重試；未指定時直接呼叫
+        self.request = request or (lambda func, **kwargs: func(**kwargs))
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.compact_after = compact_after
+        self.base_path = os.path.join(store_dir, 'notes.parquet')
+        self.parts_dir = os.path.join(store_dir, 'parts')
+        self.state_path = os.path.join(store_dir, 'state.json')
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self.state = self._load_state()
+        self._lock = asyncio.Lock()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _parts(self):
+        return sorted(
+            os.path.join(self.parts_dir, name) for name in os.listdir(self.parts_dir) if name.endswith('.parquet')
+        )
+
+    async def _data_source_id(self):
+        """API 2025-09-03 起查詢改以 data source 為單位；筆記資料庫只有一個 data source"""
+        if not self.state.get("data_source_id"):
+            database = await self.request(self.notion.databases.retrieve, database_id=self.database_id)
+            self.state["data_source_id"] = database["data_sources"][0]["id"]
+            self.state["database_created_time"] = database.get("created_time")
+        return self.state["data_source_id"]
+
+    def _windows(self, start, end):
+        """把 [start, end) 切成最多 concurrency 段，各段以獨立的游標並行分頁查詢"""
+        if start is None:
+            return [(None, end)]
+        count = self.concurrency if (end - start).total_seconds() > SPLIT_MIN_SECONDS else 1
+        step = (end - start) / count
+        bounds = [start + step * i for i in range(count)] + [end]
+        return list(zip(bounds, bounds[1:]))
+
+    async def _query_window(self, data_source_id, start, end):
+        conditions = [{"timestamp": "last_edited_time", "last_edited_time": {"before": _format_time(end)}}]
+        if start is not None:
+            conditions.append({"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": _format_time(start)}})
+        pages = []
+        cursor = None
+        while True:
+            kwargs = {"data_source_id": data_source_id, "filter": {"and": conditions}, "page_size": self.page_size,
+                      "sorts": [{"timestamp": "last_edited_time", "direction": "ascending"}]}
+            if cursor:
+                kwargs["start_cursor"] = cursor
+            response = await self.request(self.notion.data_sources.query, **kwargs)
+            pages.extend(result for result in response.get("results", []) if result.get("object") == "page")
+            cursor = response.get("next_cursor")
+            if not response.get("has_more") or not cursor:
+                return pages
+
+    def _write_part(self, rows):
+        table = pa.Table.from_pylist(rows, schema=_schema())
+        path = os.path.join(self.parts_dir, f"part-{time.time_ns()}.parquet")
+        pq.write_table(table, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def _replace_all(self, rows):
+        old_parts = self._parts()
+        pq.write_table(pa.Table.from_pylist(rows, schema=_schema()), f"{self.base_path}.tmp")
+        os.replace(f"{self.base_path}.tmp", self.base_path)
+        for path in old_parts:
+            os.remove(path)
+
+    async def sync(self, full=False):
+        """同步自上次游標之後變更的頁面，回傳本次同步的統計"""
+        async with self._lock:
+            started_at = time.monotonic()
+            await resolve(self.notion)
+            data_source_id = await self._data_source_id()
+            # 完整同步時忽略游標，取得所有頁面後才取代既有資料
+            cursor = None if full else _parse_time(self.state.get("cursor"))
+            start = cursor or _parse_time(self.state.get("database_created_time"))
+            # 結束點往後推一分鐘，涵蓋 last_edited_time 捨去到分鐘的頁面
+            end = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+            windows = self._windows(start, end)
+            results = await asyncio.gather(*(self._query_window(data_source_id, a, b) for a, b in windows))
+            pages = {page["id"]: page for window in results for page in window}
+            rows = [page_to_row(page) for page in pages.values()]
+            if full:
+                await asyncio.to_thread(self._replace_all, rows)
+            elif rows:
+                await asyncio.to_thread(self._write_part, rows)
+            if rows:
+                latest = max(row["last_edited_time"] for row in rows if row["last_edited_time"])
+                self.state["cursor"] = _format_time(max(latest, cursor) if cursor else latest)
+            stats = {
+                "pages": len(rows),
+                "windows": len(windows),
+                "seconds": round(time.monotonic() - started_at, 3),
+                "synced_at": _format_time(datetime.now(timezone.utc)),
+            }
+            self.state["last_sync"] = stats
+            self._save_state()
+            if len(self._parts()) >= self.compact_after:
+                await asyncio.to_thread(self.compact)
+            return stats
+
+    def _read_all(self):
+        """讀取主檔與所有 part 檔，每個頁面只保留最後寫入的版本"""
+        paths = ([self.base_path] if os.path.exists(self.base_path) else []) + self._parts()
+        if not paths:
+            return pa.Table.from_pylist([], schema=_schema()), paths
+        table = pa.concat_tables([pq.read_table(path, schema=_schema()) for path in paths])
+        table = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+        latest = table.group_by("page_id").aggregate([("_row", "max")])["_row_max"]
+        table = table.take(latest).drop_columns(["_row"])
+        return table, paths
+
+    def load(self, include_archived=False):
+        """回傳目前所有筆記的 pyarrow Table (供本地分析)"""
+        table, _ = self._read_all()
+        if not include_archived:
+            table = table.filter(pc.invert(table["archived"]))
+        return table
+
+    def compact(self):
+        """合併主檔與 part 檔，移除舊版本與已封存的頁面"""
+        table, paths = self._read_all()
+        table = table.filter(pc.invert(table["archived"]))
+        pq.write_table(table, f"{self.base_path}.tmp")
+        os.replace(f"{self.base_path}.tmp", self.base_path)
+        for path in paths:
+            if path != self.base_path:
+                os.remove(path)
+        print(f"Compacted Notion sync store: {table.num_rows} notes")
+
+    def report(self):
+        """各類型的筆記數與摘要長度、各 Line_ID 的筆記數"""
+        table = self.load()
+        by_type = table.group_by("note_type").aggregate([
+            ("page_id", "count"), ("summary_length", "mean"), ("summary_length", "max")
+        ])
+        by_line = table.group_by("line_id").aggregate([("page_id", "count"), ("last_edited_time", "max")])
+        return {
+            "notes": table.num_rows,
+            "by_type": by_type.to_pylist(),
+            "by_line_id": by_line.to_pylist(),
+        }
+
+    def stats(self):
+        return {
+            "cursor": self.state.get("cursor"),
+            "parts": len(self._parts()),
+            "last_sync": self.state.get("last_sync"),
+        }
+
+    async def run_forever(self, interval):
+        """定期同步，於 FastAPI 啟動時建立背景工作"""
+        while True:
+            try:
+                stats = await self.sync()
+                if stats["pages"]:
+                    print(f"Synced {stats['pages']} Notion pages in {stats['seconds']}s")
+            except Exception as e:
+                print(f"Error syncing Notion notes: {e}")
+            await asyncio.sleep(interval)
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from notion_client import AsyncClient
+
+    from notion_writer import TokenBucket
+
+    load_dotenv(os.getenv('DOTENV_PATH') or None, override=True)
+    notion = AsyncClient(auth=os.getenv('NOTION_API_KEY'), base_url=os.getenv('NOTION_BASE_URL', 'https://api.notion.com'))
+    limiter = TokenBucket(rate=float(os.getenv('NOTION_RATE_LIMIT_PER_SECOND', '3')))
+
+    async def request(func, **kwargs):
+        await limiter.acquire()
+        return await func(**kwargs)
+
+    syncer = NotionSync(
+        notion,
+        os.getenv('NOTION_DATABASE_ID'),
+        os.getenv('NOTION_SYNC_DIR', os.path.join(os.getenv('DATA_DIR', 'data'), 'notion_sync')),
+        request=request,
+        concurrency=int(os.getenv('NOTION_SYNC_CONCURRENCY', '3'))
+    )
+    try:
+        if not args.report_only:
+            print(json.dumps(await syncer.sync(full=args.full), ensure_ascii=False))
+        if args.compact:
+            syncer.compact()
+        if args.report or args.report_only:
+            print(json.dumps(syncer.report(), ensure_ascii=False, indent=2, default=str))
+    finally:
+        await notion.aclose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="將 Notion 筆記資料庫增量同步到本地 Parquet")
+    parser.add_argument('--full', action='store_true', help="忽略游標重新完整同步 (移除已刪除的頁面)")
+    parser.add_argument('--compact', action='store_true', help="同步後立即合併 part 檔")
+    parser.add_argument('--report', action='store_true', help="同步後輸出統計")
+    parser.add_argument('--report-only', action='store_true', help="不同步，只輸出本地資料的統計")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from lazy import load, resolve
+from resilience import CircuitOpenError, is_transient
+
+# Notion 每次請求最多 100 個區塊
+BLOCK_BATCH_SIZE = 100
+
+
+class TokenBucket:
+    """非同步權杖桶限流器，所有 worker 共用同一個實例"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class NotionWriter:
+    """Notion 寫入器：分批寫入區塊、共用限流、遇到 429 依 Retry-After 重試，最終失敗時存入本地 outbox
+
+    只有暫時性異常才存入 outbox 定期重送；內容錯誤 (4xx) 或重送超過 max_outbox_attempts 次的頁面
+    移到 dead_letter 資料表保留，不再重送。多個 worker 共用同一個 outbox 檔案時，重送前先逐筆認領
+    (claimed_until)，認領逾時 outbox_claim_seconds 後 (例如持有者當機) 才能被其他 worker 重送。
+    """
+
+    def __init__(self, notion, rate_limiter, outbox_path, max_retries=5, upstream=None, max_outbox_attempts=10,
+                 outbox_claim_seconds=600):
+        self.notion = notion
+        self.rate_limiter = rate_limiter
+        # resilience.Upstream：逾時、並行上限與斷路器 (斷路器開啟時直接存入 outbox)
+        self.upstream = upstream
+        self.max_retries = max_retries
+        self.max_outbox_attempts = max_outbox_attempts
+        self.outbox_claim_seconds = outbox_claim_seconds
+        directory = os.path.dirname(outbox_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(outbox_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                claimed_until REAL
+            )
+        ''')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(outbox)')]
+        if 'claimed_until' not in columns:
+            # 舊版 outbox 檔案沒有認領欄位
+            self._conn.execute('ALTER TABLE outbox ADD COLUMN claimed_until REAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+    @staticmethod
+    def _retry_delay(error, attempt):
+        # 優先採用伺服器給的 Retry-After，否則使用指數退避加隨機抖動
+        headers = getattr(error, 'headers', None) or {}
+        retry_after = headers.get('retry-after') if hasattr(headers, 'get') else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def _send(self, func, kwargs):
+        if self.upstream is None:
+            return await func(**kwargs)
+        async with self.upstream.guard():
+            return await func(**kwargs)
+
+    async def request(self, func, **kwargs):
+        """以共用限流器呼叫 Notion API，429 / 5xx / 逾時依 Retry-After 或指數退避重試 (同步筆記時也共用)"""
+        # notion_client 由 app 的 LazyClient 載入，這裡第一次使用時才取出錯誤類別
+        errors = load('notion_client.errors')
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            try:
+                return await self._send(func, kwargs)
+            except errors.APIResponseError as e:
+                if (e.status != 429 and e.status < 500) or attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"Notion API returned {e.status}, retrying in {delay:.1f}s")
+            except (errors.RequestTimeoutError, TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"Notion API timed out, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _write(self, payload):
+        """建立頁面 (含第一批區塊) 並以 blocks.children.append 補上其餘區塊；payload 會記錄進度"""
+        children = payload["children"]
+        await resolve(self.notion)
+        if payload.get("page_id") is None:
+            first = children[:BLOCK_BATCH_SIZE]
+            page = await self.request(
+                self.notion.pages.create,
+                parent=payload["parent"],
+                properties=payload["properties"],
+                children=first
+            )
+            payload["page_id"] = page["id"]
+            payload["appended"] = len(first)
+        while payload["appended"] < len(children):
+            batch = children[payload["appended"]:payload["appended"] + BLOCK_BATCH_SIZE]
+            await self.request(self.notion.blocks.children.append, block_id=payload["page_id"], children=batch)
+            payload["appended"] += len(batch)
+        return payload["page_id"]
+
+    async def create_pages(self, pages):
+        """依序寫入同一批次的多個頁面 (保留傳送順序)，回傳各頁面 id
+
+        Notion 沒有批次建立頁面的 API，每頁仍是一次請求；但若其中一頁因暫時性異常 (429、5xx、逾時、
+        斷路器開啟) 重試後仍失敗，其餘頁面直接存入 outbox，不再各自重試到上限。
+        單一頁面的內容錯誤 (例如 400) 不影響同批次的其他頁面。
+        """
+        page_ids = []
+        failure = None
+        for page in pages:
+            payload = {**page, "page_id": None, "appended": 0}
+            if failure is not None:
+                self._enqueue(payload, failure)
+                page_ids.append(None)
+                continue
+            try:
+                page_ids.append(await self._write(payload))
+            except Exception as e:
+                if self._fail(payload, e):
+                    failure = str(e)
+                page_ids.append(None)
+        return page_ids
+
+    @staticmethod
+    def _retryable(error):
+        # 4xx 等內容錯誤重送也不會成功
+        return isinstance(error, CircuitOpenError) or is_transient(error)
+
+    def _fail(self, payload, error):
+        """寫入失敗：暫時性異常存入 outbox 並回傳 True，其餘移到 dead_letter"""
+        if self._retryable(error):
+            print(f"Failed to write Notion page, saved to outbox: {error}")
+            self._enqueue(payload, str(error))
+            return True
+        print(f"Notion rejected page, moved to dead letter: {error}")
+        self._dead_letter(payload, 1, str(error), time.time())
+        return False
+
+    def _dead_letter(self, payload, attempts, error, created_at):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO dead_letter (payload, attempts, last_error, created_at) VALUES (?, ?, ?, ?)',
+                (json.dumps(payload, ensure_ascii=False), attempts, error, created_at)
+            )
+
+    def _enqueue(self, payload, error):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO outbox (payload, attempts, last_error, created_at) VALUES (?, 1, ?, ?)',
+                (json.dumps(payload, ensure_ascii=False), error, time.time())
+            )
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def dead_letter_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM dead_letter').fetchone()[0]
+
+    def _claim_next(self, after_id):
+        """原子地認領下一筆未被其他 worker 認領的 outbox 項目，沒有時回傳 None"""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE 先取得寫入鎖，避免兩個程序認領到同一筆
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id, payload, attempts, created_at FROM outbox '
+                    'WHERE id > ? AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY id LIMIT 1',
+                    (after_id, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE outbox SET claimed_until = ? WHERE id = ?', (now + self.outbox_claim_seconds, row[0])
+                    )
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+        return row
+
+    def _release(self, row_id):
+        with self._lock:
+            self._conn.execute('UPDATE outbox SET claimed_until = NULL WHERE id = ?', (row_id,))
+
+    async def flush_outbox(self):
+        """重送 outbox 中失敗的寫入 (已建立的頁面只補上未寫入的區塊)"""
+        row_id = 0
+        while True:
+            row = self._claim_next(row_id)
+            if row is None:
+                break
+            row_id, raw, attempts, created_at = row
+            payload = json.loads(raw)
+            try:
+                await self._write(payload)
+            except asyncio.CancelledError:
+                # 關閉程序時釋放認領，讓其他 worker 不必等到認領逾時
+                self._release(row_id)
+                raise
+            except CircuitOpenError:
+                # Notion 仍在異常中，釋放認領等下一輪再重送
+                print("Notion circuit is open, postponing outbox retry")
+                self._release(row_id)
+                break
+            except Exception as e:
+                print(f"Retry of Notion outbox item {row_id} failed: {e}")
+                if not self._retryable(e) or attempts + 1 >= self.max_outbox_attempts:
+                    # 內容錯誤或已達重送上限：移到 dead_letter，不再重送
+                    print(f"Moving Notion outbox item {row_id} to dead letter after {attempts + 1} attempts")
+                    self._dead_letter(payload, attempts + 1, str(e), created_at)
+                    with self._lock:
+                        self._conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+                    continue
+                with self._lock:
+                    self._conn.execute(
+                        'UPDATE outbox SET payload = ?, attempts = attempts + 1, last_error = ?, claimed_until = NULL '
+                        'WHERE id = ?',
+                        (json.dumps(payload, ensure_ascii=False), str(e), row_id)
+                    )
+                continue
+            with self._lock:
+                self._conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+            print(f"Notion outbox item {row_id} delivered")
+
+    async def run_outbox_retry_loop(self, interval):
+        """定期重送 outbox，於 FastAPI 啟動時建立背景工作"""
+        while True:
+            try:
+                if self.pending_count():
+                    await self.flush_outbox()
+            except Exception as e:
+                print(f"Error flushing Notion outbox: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,72 @@
+import asyncio
+import inspect
+import time
+
+
+class StageGraph:
+    """以依賴關係描述的處理階段圖，彼此獨立的階段會並行執行"""
+
+    def __init__(self):
+        self._stages = {}
+        # 最近一次執行時各階段耗費的秒數
+        self.timings = {}
+
+    def add(self, name, func, after=()):
+        """新增階段；func 以依賴階段 (或輸入) 的結果作為關鍵字參數"""
+        if name in self._stages:
+            raise ValueError(f"Stage '{name}' already exists")
+        self._stages[name] = (func, tuple(after))
+        return self
+
+    def _check(self, inputs):
+        # 檢查依賴是否存在且沒有循環
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle detected at stage '{name}'")
+            visiting.add(name)
+            for dep in self._stages[name][1]:
+                if dep in self._stages:
+                    visit(dep)
+                elif dep not in inputs:
+                    raise ValueError(f"Stage '{name}' depends on unknown '{dep}'")
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self._stages:
+            visit(name)
+
+    async def run(self, **inputs):
+        """執行整張階段圖，回傳包含輸入與各階段結果的 dict"""
+        self._check(inputs)
+        results = dict(inputs)
+        tasks = {}
+
+        async def run_stage(name):
+            func, deps = self._stages[name]
+            pending = [tasks[dep] for dep in deps if dep in tasks]
+            if pending:
+                await asyncio.gather(*pending)
+            kwargs = {dep: results[dep] for dep in deps}
+            started_at = time.monotonic()
+            result = func(**kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            self.timings[name] = time.monotonic() - started_at
+            results[name] = result
+            return result
+
+        # 先建立所有工作再開始等待，讓每個階段在依賴完成後立即啟動
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(run_stage(name), name=f"stage-{name}")
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return results
@@ -0,0 +1,192 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+
+# 代表上游暫時性異常的 HTTP 狀態碼 (逾時、限流、伺服器錯誤)
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# 各 SDK 連線層錯誤的類別名稱片段，依繼承鏈比對 (httpx.ConnectError → TransportError、
+# aiohttp.ServerDisconnectedError → ClientConnectionError 等)，不必匯入這些套件
+_TRANSIENT_NAME_PARTS = ('Timeout', 'Connection', 'Transport', 'Network', 'ClientPayloadError')
+# 本機檔案錯誤不代表上游異常
+_LOCAL_OS_ERRORS = (FileNotFoundError, FileExistsError, PermissionError, IsADirectoryError, NotADirectoryError)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，直接拒絕呼叫"""
+
+    def __init__(self, name):
+        super().__init__(f"Circuit for {name} is open")
+        self.name = name
+
+
+def is_transient(error):
+    """判斷錯誤是否為上游暫時性異常 (可重試、計入斷路器)；4xx 等呼叫端錯誤不算"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status in TRANSIENT_STATUS
+    if isinstance(error, OSError) and not isinstance(error, _LOCAL_OS_ERRORS):
+        return True
+    # 各 SDK 的連線層錯誤 (httpx.TransportError、aiohttp.ClientConnectionError、openai.APIConnectionError 等) 沒有狀態碼
+    return any(
+        word in cls.__name__ for cls in type(error).__mro__ for word in _TRANSIENT_NAME_PARTS
+    )
+
+
+class CircuitBreaker:
+    """連續失敗達門檻即開啟，冷卻後放行一個試探請求 (half-open)，成功才恢復"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                print(f"Circuit opened after {self.failures} consecutive failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class AdaptiveLimit:
+    """自適應並行上限 (AIMD)：成功時緩慢調升，逾時或上游錯誤時減半"""
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, overloaded):
+        async with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                # 每完成約一個上限數量的請求才加 1
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Upstream:
+    """單一外部服務的保護層：逾時、並行上限 (bulkhead)、抖動退避重試與斷路器"""
+
+    def __init__(self, name, timeout=60, max_concurrency=8, retries=0, backoff_base=0.5, backoff_max=10,
+                 failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.limit = AdaptiveLimit(max_concurrency)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def guard(self, timeout=None):
+        """以斷路器、並行上限與逾時保護區塊內的單次呼叫 (不重試，適用於串流等無法重跑的呼叫)"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(self.name)
+        await self.limit.acquire()
+        self.calls += 1
+        overloaded = False
+        try:
+            async with asyncio.timeout(timeout or self.timeout):
+                yield
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                self.timeouts += 1
+            if is_transient(e):
+                overloaded = True
+                self.failures += 1
+                self.breaker.record_failure()
+            else:
+                # 上游有回應 (例如 400)，服務本身正常
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            # 被取消 (例如對沖擷取的另一方先完成) 不影響斷路器，但 half-open 試探需要釋放
+            if self.breaker.state == HALF_OPEN:
+                self.breaker._probe_in_flight = False
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            await self.limit.release(overloaded)
+
+    @property
+    def available(self):
+        """斷路器未開啟，或已過冷卻時間可以試探"""
+        breaker = self.breaker
+        return breaker.state != OPEN or time.monotonic() - breaker.opened_at >= breaker.reset_timeout
+
+    def _backoff(self, attempt):
+        # full jitter：在 0 到指數上限之間隨機等待，避免所有 worker 同時重試
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def call(self, func, *args, retries=None, timeout=None, **kwargs):
+        """呼叫 func(*args, **kwargs) (需回傳 awaitable)，暫時性錯誤依設定重試"""
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                async with self.guard(timeout):
+                    return await func(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if attempt >= retries or not is_transient(e):
+                    raise
+                delay = self._backoff(attempt)
+                print(f"{self.name} call failed ({e!r}), retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "concurrency_limit": round(self.limit.limit, 2),
+            "in_flight": self.limit.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,189 @@
+import asyncio
+import re
+
+from lazy import optional
+from metrics import span
+
+# 中日韓文字大約一字一個 token，其餘文字約四個字元一個 token
+_WIDE_CHARS = re.compile(r'[⺀-鿿가-힯豈-﫿＀-￯]')
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;\.])\s*')
+
+
+class TokenCounter:
+    """計算文字的 token 數 (優先使用 tiktoken)"""
+
+    def __init__(self, model):
+        self._encoding = None
+        # tiktoken 為選用套件，未安裝時以字元數估算 token
+        tiktoken = optional('tiktoken')
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:
+                print(f"Error loading tiktoken encoding, falling back to estimate: {e}")
+
+    def count(self, text):
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        wide = len(_WIDE_CHARS.findall(text))
+        return wide + (len(text) - wide + 3) // 4
+
+
+def _split_units(text, counter, max_tokens):
+    """將文字拆成不超過 max_tokens 的單位：先依段落，再依句子，最後依字元硬切"""
+    units = []
+    for paragraph in text.splitlines(keepends=True):
+        if counter.count(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            if not sentence:
+                continue
+            tokens = counter.count(sentence)
+            if tokens <= max_tokens:
+                units.append(sentence)
+                continue
+            # 沒有標點的超長句子依比例以字元切開
+            step = max(1, len(sentence) * max_tokens // tokens)
+            units.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+    return units
+
+
+def split_into_chunks(text, counter, chunk_tokens=3000, overlap_tokens=200):
+    """依 token 數將長文切成多段，相鄰段落重疊 overlap_tokens 以保留上下文"""
+    units = [(unit, counter.count(unit)) for unit in _split_units(text, counter, chunk_tokens)]
+    chunks = []
+    current, current_tokens = [], 0
+    for unit, tokens in units:
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(''.join(u for u, _ in current))
+            # 將上一段結尾的部分單位帶入下一段
+            overlap, overlap_count = [], 0
+            for previous in reversed(current):
+                if overlap_count + previous[1] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_count += previous[1]
+            current, current_tokens = overlap, overlap_count
+        current.append((unit, tokens))
+        current_tokens += tokens
+    if current:
+        chunks.append(''.join(u for u, _ in current))
+    return chunks
+
+
+class MapReduceSummarizer:
+    """長文摘要：短內容單次呼叫；長內容切段並行摘要 (map)，再合併成最終摘要 (reduce) 並串流輸出"""
+
+    def __init__(self, model, single_pass_tokens=6000, chunk_tokens=3000, overlap_tokens=200,
+                 concurrency=4, partial_max_tokens=400, rate_limiter=None, upstream=None):
+        self.model = model
+        self.single_pass_tokens = single_pass_tokens
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.partial_max_tokens = partial_max_tokens
+        self.counter = TokenCounter(model)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # 可選的共用限流器 (具備 async acquire())
+        self.rate_limiter = rate_limiter
+        # 可選的 resilience.Upstream：每次呼叫各自套用逾時、並行上限與斷路器 (長文不會共用一次逾時)
+        self.upstream = upstream
+
+    async def _create(self, client, system_prompt, content):
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        response = await client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content}
+            ],
+            max_tokens=self.partial_max_tokens
+        )
+        return response.choices[0].message.content or ""
+
+    async def _complete(self, client, system_prompt, content):
+        async with self._semaphore:
+            if self.upstream is not None:
+                return await self.upstream.call(self._create, client, system_prompt, content)
+            return await self._create(client, system_prompt, content)
+
+    async def _stream_deltas(self, client, system_prompt, content):
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        stream = await client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content}
+            ],
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _stream_completion(self, client, system_prompt, content):
+        # 串流無法重跑，只以 guard 保護這一次呼叫
+        if self.upstream is None:
+            async for delta in self._stream_deltas(client, system_prompt, content):
+                yield delta
+            return
+        async with self.upstream.guard():
+            async for delta in self._stream_deltas(client, system_prompt, content):
+                yield delta
+
+    async def _map(self, client, chunks, system_prompt):
+        """各段落並行摘要 (以 semaphore 限制同時呼叫數)"""
+        total = len(chunks)
+        return await asyncio.gather(*(
+            self._complete(
+                client, system_prompt,
+                f"以下是一篇長篇內容的第 {i}/{total} 段，請條列這一段的重點 (保留關鍵數字、人名與結論)：\n\n{chunk}"
+            )
+            for i, chunk in enumerate(chunks, start=1)
+        ))
+
+    def _join(self, partials):
+        return "\n\n".join(f"第 {i} 段重點：\n{partial}" for i, partial in enumerate(partials, start=1))
+
+    async def _collapse(self, client, partials, system_prompt):
+        """分段重點合併後仍過長時，分組再摘要一次，直到能放進單次呼叫"""
+        while len(partials) > 1 and self.counter.count(self._join(partials)) > self.single_pass_tokens:
+            groups, current, current_tokens = [], [], 0
+            for partial in partials:
+                tokens = self.counter.count(partial)
+                if current and current_tokens + tokens > self.chunk_tokens:
+                    groups.append(current)
+                    current, current_tokens = [], 0
+                current.append(partial)
+                current_tokens += tokens
+            groups.append(current)
+            if len(groups) == len(partials):
+                # 無法再合併 (單一重點已超過段落上限)，直接進入最終摘要
+                break
+            partials = await asyncio.gather(*(
+                self._complete(client, system_prompt, f"請將以下各段重點整合成一份條列重點：\n\n{self._join(group)}")
+                for group in groups
+            ))
+        return partials
+
+    async def stream(self, client, text, instruction, system_prompt):
+        """逐步產出摘要文字片段 (async generator)"""
+        if self.counter.count(text) <= self.single_pass_tokens:
+            async for delta in self._stream_completion(client, system_prompt, f"{instruction}\n\n{text}"):
+                yield delta
+            return
+
+        chunks = split_into_chunks(text, self.counter, self.chunk_tokens, self.overlap_tokens)
+        with span("summary_map"):
+            partials = await self._map(client, chunks, system_prompt)
+            partials = await self._collapse(client, [p for p in partials if p], system_prompt)
+        content = (
+            f"{instruction}\n\n"
+            f"(內容較長，以下是依原文順序分段整理的重點，請整合成一份完整摘要)\n\n{self._join(partials)}"
+        )
+        async for delta in self._stream_completion(client, system_prompt, content):
+            yield delta
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_content(text):
+    """正規化內容 (Unicode NFC、合併空白) 讓只差在空白的內容共用快取"""
+    text = unicodedata.normalize('NFC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def make_summary_key(text, prompt_type, model):
+    payload = f"{model}\x00{prompt_type}\x00{normalize_content(text)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SummaryCache:
+    """摘要結果快取：記憶體 LRU 為第一層，可選用 SQLite 作為第二層、協調後端作為跨程序共用層"""
+
+    def __init__(self, max_entries=500, disk_path=None, shared=None, shared_ttl=7 * 86400):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._conn = None
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS summaries (
+                    key TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+
+    def _remember(self, key, summary):
+        self._memory[key] = summary
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, text, prompt_type, model):
+        key = make_summary_key(text, prompt_type, model)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            if self._conn is not None:
+                row = self._conn.execute('SELECT summary FROM summaries WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+        if self.shared is not None:
+            summary = self.shared.get(f"summary:{key}")
+            if summary is not None:
+                with self._lock:
+                    self._remember(key, summary)
+                    self.shared_hits += 1
+                return summary
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, text, prompt_type, model, summary):
+        key = make_summary_key(text, prompt_type, model)
+        with self._lock:
+            self._remember(key, summary)
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)',
+                    (key, summary, time.time())
+                )
+        if self.shared is not None:
+            self.shared.set(f"summary:{key}", summary, self.shared_ttl)
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# 不影響內容的追蹤參數，正規化時移除
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'igshid', 'igsh', 'mibextid',
+    'mc_cid', 'mc_eid', 'ref', 'ref_src', 'ref_url', 'si', 'xmt', 'spm',
+    '__cft__[0]', '__tn__', 'rdid', 'share_url', 'sfnsn',
+}
+
+# 同一服務的不同網域統一成一個
+HOST_ALIASES = {
+    'threads.com': 'www.threads.net',
+    'www.threads.com': 'www.threads.net',
+    'threads.net': 'www.threads.net',
+    'facebook.com': 'www.facebook.com',
+    'm.facebook.com': 'www.facebook.com',
+    'mbasic.facebook.com': 'www.facebook.com',
+    'web.facebook.com': 'www.facebook.com',
+}
+
+# 需要先解析轉址才能得到實際內容網址的短網址網域
+REDIRECT_HOSTS = {'fb.watch', 'www.fb.watch'}
+
+
+def canonicalize_url(url):
+    """正規化網址：統一大小寫與網域、移除追蹤參數與錨點、排序查詢參數"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or 'https'
+    host = (parts.hostname or '').lower()
+    host = HOST_ALIASES.get(host, host)
+    netloc = host
+    if parts.port and not (scheme == 'http' and parts.port == 80) and not (scheme == 'https' and parts.port == 443):
+        netloc = f"{host}:{parts.port}"
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS
+    ]
+    query.sort()
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def needs_redirect_resolution(url):
+    """判斷網址是否為需要先解析轉址的短網址"""
+    return (urlsplit(url).hostname or '').lower() in REDIRECT_HOSTS
+
+
+async def resolve_redirects(url, http_client):
+    """追蹤短網址轉址取得最終網址，失敗時回傳原網址"""
+    try:
+        response = await http_client.head(url, follow_redirects=True)
+        return str(response.url)
+    except Exception as e:
+        print(f"Error resolving redirect for {url}: {e}")
+        return url
+
+
+class ExtractionCache:
+    """以正規化網址雜湊為鍵的擷取結果快取 (SQLite 持久化、依來源設定 TTL、LRU 淘汰)"""
+
+    def __init__(self, path, ttls=None, default_ttl=86400, max_entries=1000, max_bytes=50 * 1024 * 1024, shared=None):
+        self.ttls = ttls or {}
+        # 協調後端 (coordination.py)：本機未命中時查詢其他程序或機器寫入的結果
+        self.shared = shared
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                source TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_extractions_last_access ON extractions (last_access)')
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha256(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+    def get(self, url):
+        """取得快取內容，不存在或已過期時回傳 None"""
+        key = self.make_key(url)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT content, expires_at FROM extractions WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and row[1] >= now:
+                self._conn.execute('UPDATE extractions SET last_access = ? WHERE key = ?', (now, key))
+                self.hits += 1
+                return row[0]
+            if row is not None:
+                self._conn.execute('DELETE FROM extractions WHERE key = ?', (key,))
+        if self.shared is not None:
+            content = self.shared.get(f"extract:{key}")
+            if content is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                return content
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, url, source, content):
+        """寫入擷取結果並依容量上限淘汰最久未使用的項目"""
+        now = time.time()
+        ttl = self.ttls.get(source, self.default_ttl)
+        size = len(content.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.make_key(url), canonicalize_url(url), source, content, size, now + ttl, now)
+            )
+            self._evict(now)
+        if self.shared is not None:
+            self.shared.set(f"extract:{self.make_key(url)}", content, ttl)
+
+    def _evict(self, now):
+        self._conn.execute('DELETE FROM extractions WHERE expires_at < ?', (now,))
+        count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._conn.execute('SELECT key, size FROM extractions ORDER BY last_access').fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM extractions WHERE key = ?', (key,))
+            count -= 1
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions').fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses}
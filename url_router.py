@@ -0,0 +1,68 @@
+import re
+from urllib.parse import urlsplit
+
+# 訊息中的網址 (遇到空白、引號、全形標點或中日韓文字即結束；網址中的非 ASCII 字元通常已編碼)
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'\u3000-\u303f\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]+')
+# 網址結尾常黏著的標點，不屬於網址本身
+_TRAILING_PUNCTUATION = '.,;:!?]}>'
+
+
+def _strip_trailing(url):
+    while url:
+        if url[-1] in _TRAILING_PUNCTUATION:
+            url = url[:-1]
+        elif url[-1] == ')' and url.count(')') > url.count('('):
+            # 只移除沒有配對的右括號 (例如維基百科網址本身含括號)
+            url = url[:-1]
+        else:
+            break
+    return url
+
+
+def find_urls(text, limit=None):
+    """依出現順序取出訊息中所有不重複的網址"""
+    urls = []
+    for match in URL_PATTERN.finditer(text):
+        url = _strip_trailing(match.group(0))
+        if url not in urls:
+            urls.append(url)
+            if limit and len(urls) >= limit:
+                break
+    return urls
+
+
+class Extractor:
+    """一種網址來源的擷取設定：name 同時作為擷取快取的來源 (決定 TTL)"""
+
+    def __init__(self, name, fetch, note_type, summary_type='web'):
+        self.name = name
+        # async fetch(url) -> 內容文字或 None
+        self.fetch = fetch
+        self.note_type = note_type
+        self.summary_type = summary_type
+
+
+class UrlRouter:
+    """依網域將網址分派給註冊的擷取器；網域表預先建立，查詢時只比對主機名稱的各層後綴
+
+    例如註冊 facebook.com 會比對 facebook.com 與 m.facebook.com，但不會比對 notfacebook.com
+    或查詢參數中出現 facebook.com 的網址。
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._by_host = {}
+
+    def register(self, hosts, extractor):
+        for host in hosts:
+            self._by_host[host.lower().lstrip('.')] = extractor
+        return extractor
+
+    def route(self, url):
+        host = (urlsplit(url).hostname or '').lower()
+        labels = host.split('.')
+        for i in range(len(labels) - 1):
+            extractor = self._by_host.get('.'.join(labels[i:]))
+            if extractor is not None:
+                return extractor
+        return self.default